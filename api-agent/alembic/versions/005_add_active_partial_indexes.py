@@ -0,0 +1,61 @@
+"""Add partial indexes for active (not soft-deleted) rows
+
+Revision ID: 005
+Revises: 004
+Create Date: 2024-01-19 12:00:00.000000
+
+"""
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '005'
+down_revision: str | None = '004'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+ACTIVE_ROWS = sa.text('deleted_at IS NULL')
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    inspector = sa.inspect(connection)
+    conversation_indexes = {index['name'] for index in inspector.get_indexes('conversations')}
+    message_indexes = {index['name'] for index in inspector.get_indexes('messages')}
+
+    # CONCURRENTLY no puede ejecutarse dentro de una transacción
+    with op.get_context().autocommit_block():
+        if 'ix_conversations_active' not in conversation_indexes:
+            op.create_index(
+                'ix_conversations_active',
+                'conversations',
+                ['id'],
+                postgresql_where=ACTIVE_ROWS,
+                postgresql_concurrently=True,
+            )
+
+        if 'ix_conversations_user_active' not in conversation_indexes:
+            op.create_index(
+                'ix_conversations_user_active',
+                'conversations',
+                ['user_id'],
+                postgresql_where=ACTIVE_ROWS,
+                postgresql_concurrently=True,
+            )
+
+        if 'ix_messages_conversation_active' not in message_indexes:
+            op.create_index(
+                'ix_messages_conversation_active',
+                'messages',
+                ['conversation_id', 'created_at'],
+                postgresql_where=ACTIVE_ROWS,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_conversation_active', table_name='messages', postgresql_concurrently=True)
+        op.drop_index('ix_conversations_user_active', table_name='conversations', postgresql_concurrently=True)
+        op.drop_index('ix_conversations_active', table_name='conversations', postgresql_concurrently=True)
@@ -0,0 +1,64 @@
+"""Add covering index on messages and LZ4 compression for content
+
+The (conversation_id, id) index replaces ix_messages_conversation_active from 005:
+every message read orders by id, so the created_at index only slowed down inserts.
+
+Revision ID: 006
+Revises: 005
+Create Date: 2024-01-20 12:00:00.000000
+
+"""
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '006'
+down_revision: str | None = '005'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    inspector = sa.inspect(connection)
+    existing_indexes = {index['name'] for index in inspector.get_indexes('messages')}
+
+    # La compresión por columna (LZ4) existe desde PostgreSQL 14; aplica a las filas nuevas
+    if connection.dialect.server_version_info >= (14,):
+        op.execute(sa.text("ALTER TABLE messages ALTER COLUMN content SET COMPRESSION lz4"))
+
+    # CONCURRENTLY no puede ejecutarse dentro de una transacción
+    with op.get_context().autocommit_block():
+        if 'ix_messages_conv_id' not in existing_indexes:
+            op.create_index(
+                'ix_messages_conv_id',
+                'messages',
+                ['conversation_id', 'id'],
+                postgresql_include=['role'],
+                postgresql_where=sa.text('deleted_at IS NULL'),
+                postgresql_concurrently=True,
+            )
+
+        if 'ix_messages_conversation_active' in existing_indexes:
+            op.drop_index(
+                'ix_messages_conversation_active',
+                table_name='messages',
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_conversation_active',
+            'messages',
+            ['conversation_id', 'created_at'],
+            postgresql_where=sa.text('deleted_at IS NULL'),
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_messages_conv_id', table_name='messages', postgresql_concurrently=True)
+
+    connection = op.get_bind()
+    if connection.dialect.server_version_info >= (14,):
+        op.execute(sa.text("ALTER TABLE messages ALTER COLUMN content SET COMPRESSION DEFAULT"))
@@ -1,130 +1,118 @@
+import asyncio
 import json
 import logging
 from typing import Any
 
-import pika
-from pika.exceptions import AMQPConnectionError, AMQPChannelError
+import aio_pika
+from aio_pika.abc import AbstractRobustChannel, AbstractRobustConnection
+from aio_pika.exceptions import AMQPError
 
 from src.configuration.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Tiempo máximo de espera del ACK del broker por mensaje
+PUBLISH_TIMEOUT_SECONDS = 10
+
 
 class RabbitMQService:
-    """Servicio para enviar mensajes a RabbitMQ"""
+    """
+    Servicio asíncrono para enviar mensajes a RabbitMQ.
+
+    Mantiene una conexión y un canal persistentes (con publisher confirms) que se
+    comparten entre requests: las confirmaciones de transferencias concurrentes
+    viajan en paralelo por el mismo canal en lugar de abrir uno por envío.
+    """
 
     def __init__(self):
-        self.connection = None
-        self.channel = None
-        self._connect()
+        self.connection: AbstractRobustConnection | None = None
+        self.channel: AbstractRobustChannel | None = None
+        self._lock = asyncio.Lock()
 
-    def _connect(self):
+    async def connect(self):
         """Establece conexión con RabbitMQ"""
         try:
-            credentials = pika.PlainCredentials(
-                settings.RABBITMQ_USER, settings.RABBITMQ_PASSWORD
-            )
-            parameters = pika.ConnectionParameters(
+            self.connection = await aio_pika.connect_robust(
                 host=settings.RABBITMQ_HOST,
                 port=settings.RABBITMQ_PORT,
-                virtual_host=settings.RABBITMQ_VHOST,
-                credentials=credentials,
+                login=settings.RABBITMQ_USER,
+                password=settings.RABBITMQ_PASSWORD,
+                virtualhost=settings.RABBITMQ_VHOST,
             )
-            self.connection = pika.BlockingConnection(parameters)
-            self.channel = self.connection.channel()
+            # Publisher confirms: publish espera el ACK del broker
+            self.channel = await self.connection.channel(publisher_confirms=True)
             # Declarar la cola para asegurar que existe
-            self.channel.queue_declare(queue=settings.RABBITMQ_TRANSFER_QUEUE, durable=True)
+            await self.channel.declare_queue(settings.RABBITMQ_TRANSFER_QUEUE, durable=True)
             logger.info("Conexión a RabbitMQ establecida exitosamente")
-        except AMQPConnectionError as e:
-            logger.error(f"Error al conectar con RabbitMQ: {str(e)}")
+        except AMQPError as e:
+            logger.error("Error al conectar con RabbitMQ: %s", e)
             raise
         except Exception as e:
-            logger.error(f"Error inesperado al conectar con RabbitMQ: {str(e)}")
+            logger.error("Error inesperado al conectar con RabbitMQ: %s", e)
             raise
 
-    def _ensure_connection(self):
+    async def _ensure_connection(self):
         """Asegura que la conexión esté activa"""
-        if self.connection is None or self.connection.is_closed:
-            if self.channel is not None and not self.channel.is_closed:
-                try:
-                    self.channel.close()
-                except Exception:
-                    pass
-            self._connect()
-
-    def send_transfer(self, transfer_data: dict[str, Any]) -> bool:
+        if self.channel is not None and not self.channel.is_closed:
+            return
+
+        async with self._lock:
+            if self.channel is None or self.channel.is_closed:
+                await self.connect()
+
+    async def send_transfer(self, transfer_data: dict[str, Any]) -> bool:
         try:
-            self._ensure_connection()
+            await self._ensure_connection()
 
             transaction_id = transfer_data.get("transaction_id")
-            recipient_phone = transfer_data.get("recipient_phone")
-            amount = transfer_data.get("amount")
-            currency = transfer_data.get("currency", "COP")
-            user_id = transfer_data.get("user_id")
-            conversation_id = transfer_data.get("conversation_id")
-            
+            # Logging perezoso: el mensaje solo se formatea si el nivel INFO está activo
             logger.info(
-                f"Enviando mensaje a la cola RabbitMQ - Cola: {settings.RABBITMQ_TRANSFER_QUEUE}, "
-                f"Transaction ID: {transaction_id}, Recipient Phone: {recipient_phone}, "
-                f"Amount: {amount} {currency}, User ID: {user_id}, Conversation ID: {conversation_id}"
+                "Enviando mensaje a la cola RabbitMQ - Cola: %s, Transaction ID: %s, "
+                "Recipient Phone: %s, Amount: %s %s, User ID: %s, Conversation ID: %s",
+                settings.RABBITMQ_TRANSFER_QUEUE,
+                transaction_id,
+                transfer_data.get("recipient_phone"),
+                transfer_data.get("amount"),
+                transfer_data.get("currency", "COP"),
+                transfer_data.get("user_id"),
+                transfer_data.get("conversation_id"),
             )
 
-            message_body = json.dumps(transfer_data, ensure_ascii=False)
-            self.channel.basic_publish(
-                exchange="",
-                routing_key=settings.RABBITMQ_TRANSFER_QUEUE,
-                body=message_body,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Hace el mensaje persistente
+            message_body = json.dumps(transfer_data, ensure_ascii=False).encode()
+            await self.channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=message_body,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,  # Hace el mensaje persistente
                 ),
+                routing_key=settings.RABBITMQ_TRANSFER_QUEUE,
+                timeout=PUBLISH_TIMEOUT_SECONDS,
             )
             logger.info(
-                f"Mensaje enviado exitosamente a la cola RabbitMQ - Cola: {settings.RABBITMQ_TRANSFER_QUEUE}, "
-                f"Transaction ID: {transaction_id}, Tamaño del mensaje: {len(message_body)} bytes"
+                "Mensaje enviado exitosamente a la cola RabbitMQ - Cola: %s, "
+                "Transaction ID: %s, Tamaño del mensaje: %s bytes",
+                settings.RABBITMQ_TRANSFER_QUEUE,
+                transaction_id,
+                len(message_body),
             )
             return True
-        except (AMQPConnectionError, AMQPChannelError) as e:
-            logger.error(f"Error al enviar mensaje a RabbitMQ: {str(e)}")
-            # Intentar reconectar
-            try:
-                self._connect()
-                # Reintentar el envío
-                transaction_id = transfer_data.get("transaction_id")
-                logger.info(
-                    f"Reintentando envío de mensaje a la cola RabbitMQ después de reconexión - "
-                    f"Transaction ID: {transaction_id}, Cola: {settings.RABBITMQ_TRANSFER_QUEUE}"
-                )
-                
-                message_body = json.dumps(transfer_data, ensure_ascii=False)
-                self.channel.basic_publish(
-                    exchange="",
-                    routing_key=settings.RABBITMQ_TRANSFER_QUEUE,
-                    body=message_body,
-                    properties=pika.BasicProperties(delivery_mode=2),
-                )
-                logger.info(
-                    f"Mensaje enviado exitosamente a la cola RabbitMQ después de reconexión - "
-                    f"Cola: {settings.RABBITMQ_TRANSFER_QUEUE}, Transaction ID: {transaction_id}, "
-                    f"Tamaño del mensaje: {len(message_body)} bytes"
-                )
-                return True
-            except Exception as retry_error:
-                logger.error(f"Error al reintentar envío a RabbitMQ: {str(retry_error)}")
-                return False
-        except Exception as e:
-            logger.error(f"Error inesperado al enviar mensaje a RabbitMQ: {str(e)}")
+        except (AMQPError, TimeoutError) as e:
+            # La conexión robusta se restablece sola; el envío se reporta como fallido
+            logger.error("Error al enviar mensaje a RabbitMQ: %s", e)
+            return False
+        except Exception:
+            logger.exception("Error inesperado al enviar mensaje a RabbitMQ")
             return False
 
-    def close(self):
+    async def close(self):
         """Cierra la conexión con RabbitMQ"""
         try:
             if self.channel and not self.channel.is_closed:
-                self.channel.close()
+                await self.channel.close()
             if self.connection and not self.connection.is_closed:
-                self.connection.close()
+                await self.connection.close()
             logger.info("Conexión a RabbitMQ cerrada")
         except Exception as e:
-            logger.error(f"Error al cerrar conexión con RabbitMQ: {str(e)}")
+            logger.error("Error al cerrar conexión con RabbitMQ: %s", e)
 
 
 # Instancia global del servicio
@@ -137,4 +125,3 @@ def get_rabbitmq_service() -> RabbitMQService:
     if _rabbitmq_service is None:
         _rabbitmq_service = RabbitMQService()
     return _rabbitmq_service
-
@@ -1,8 +1,9 @@
-import json
+import asyncio
 import logging
 from typing import Any
 
-import redis
+import orjson
+from redis import asyncio as redis
 from redis.exceptions import ConnectionError, RedisError
 
 from src.configuration.config import settings
@@ -11,16 +12,25 @@ logger = logging.getLogger(__name__)
 
 
 class RedisService:
-    """Servicio para interactuar con Redis"""
+    """
+    Servicio asíncrono para interactuar con Redis.
+
+    Un único cliente por proceso sobre un pool de conexiones persistentes: las operaciones
+    reutilizan conexiones ya abiertas (sin handshake TCP ni AUTH por llamada) y el pool
+    las restablece solo si Redis se reinicia.
+    """
 
     def __init__(self):
+        # La conexión se establece en la primera operación, ya dentro del event loop
         self.client: redis.Redis | None = None
-        self._connect()
+        self._lock = asyncio.Lock()
 
-    def _connect(self):
+    async def _connect(self):
         """Establece conexión con Redis"""
+        client = None
         try:
-            self.client = redis.Redis(
+            # Bloqueante: con el pool lleno se espera una conexión libre en lugar de fallar
+            pool = redis.BlockingConnectionPool(
                 host=settings.REDIS_HOST,
                 port=settings.REDIS_PORT,
                 password=settings.REDIS_PASSWORD if settings.REDIS_PASSWORD else None,
@@ -28,106 +38,183 @@ class RedisService:
                 decode_responses=True,
                 socket_connect_timeout=5,
                 socket_timeout=5,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=5,
             )
-            # Verificar conexión
-            self.client.ping()
+            client = redis.Redis(connection_pool=pool)
+            # Verificar conexión antes de publicar el cliente
+            await client.ping()
+            self.client = client
             logger.info("Conexión a Redis establecida exitosamente")
         except ConnectionError as e:
-            logger.warning(f"No se pudo conectar a Redis: {str(e)}. Continuando sin caché.")
-            self.client = None
+            logger.warning("No se pudo conectar a Redis: %s. Continuando sin caché.", e)
+            await self._discard(client)
         except Exception as e:
-            logger.warning(f"Error inesperado al conectar con Redis: {str(e)}. Continuando sin caché.")
-            self.client = None
-
-    def _ensure_connection(self):
-        """Asegura que la conexión esté activa"""
-        if self.client is None:
-            self._connect()
-        elif not self._is_connected():
-            self._connect()
-
-    def _is_connected(self) -> bool:
-        """Verifica si la conexión está activa"""
-        if self.client is None:
-            return False
-        try:
-            self.client.ping()
-            return True
-        except (ConnectionError, RedisError):
-            return False
+            logger.warning("Error inesperado al conectar con Redis: %s. Continuando sin caché.", e)
+            await self._discard(client)
+
+    @staticmethod
+    async def _discard(client: redis.Redis | None):
+        """Cierra el pool de un cliente que no llegó a usarse"""
+        if client is not None:
+            try:
+                await client.aclose(close_connection_pool=True)
+            except Exception:
+                pass
+
+    async def _ensure_connection(self):
+        """
+        Crea el cliente si aún no existe. No hace PING por operación: el pool descarta y
+        reabre las conexiones caídas, y los errores de cada operación ya se manejan.
+
+        El lock evita que dos requests con el proceso en frío abran cada uno su propio pool.
+        """
+        if self.client is not None:
+            return
 
-    def get(self, key: str) -> dict[str, Any] | None:
+        async with self._lock:
+            if self.client is None:
+                await self._connect()
+
+    async def get(self, key: str) -> dict[str, Any] | None:
         """Obtiene un valor del caché"""
         try:
-            self._ensure_connection()
+            await self._ensure_connection()
             if self.client is None:
                 return None
 
-            value = self.client.get(key)
+            value = await self.client.get(key)
             if value is None:
                 return None
 
-            return json.loads(value)
-        except (ConnectionError, RedisError, json.JSONDecodeError) as e:
-            logger.warning(f"Error al obtener de Redis (key={key}): {str(e)}")
+            return orjson.loads(value)
+        except (ConnectionError, RedisError, orjson.JSONDecodeError) as e:
+            logger.warning("Error al obtener de Redis (key=%s): %s", key, e)
             return None
         except Exception as e:
-            logger.error(f"Error inesperado al obtener de Redis (key={key}): {str(e)}")
+            logger.error("Error inesperado al obtener de Redis (key=%s): %s", key, e)
             return None
 
-    def set(self, key: str, value: dict[str, Any], ttl: int | None = None) -> bool:
+    async def set(self, key: str, value: dict[str, Any], ttl: int | None = None) -> bool:
         """Guarda un valor en el caché"""
         try:
-            self._ensure_connection()
+            await self._ensure_connection()
             if self.client is None:
                 return False
 
-            json_value = json.dumps(value, ensure_ascii=False)
+            # orjson serializa a bytes UTF-8 compactos, sin pasar por str
+            json_value = orjson.dumps(value)
             ttl = ttl or settings.REDIS_TTL
-            self.client.setex(key, ttl, json_value)
+            await self.client.setex(key, ttl, json_value)
             return True
         except (ConnectionError, RedisError) as e:
-            logger.warning(f"Error al guardar en Redis (key={key}): {str(e)}")
+            logger.warning("Error al guardar en Redis (key=%s): %s", key, e)
             return False
         except Exception as e:
-            logger.error(f"Error inesperado al guardar en Redis (key={key}): {str(e)}")
+            logger.error("Error inesperado al guardar en Redis (key=%s): %s", key, e)
             return False
 
-    def delete(self, key: str) -> bool:
+    async def get_hash(self, key: str) -> dict[str, Any] | None:
+        """Obtiene todos los campos de un hash del caché (cada campo se guarda como JSON)"""
+        try:
+            await self._ensure_connection()
+            if self.client is None:
+                return None
+
+            values = await self.client.hgetall(key)
+            if not values:
+                return None
+
+            return {field: orjson.loads(value) for field, value in values.items()}
+        except (ConnectionError, RedisError, orjson.JSONDecodeError) as e:
+            logger.warning("Error al obtener hash de Redis (key=%s): %s", key, e)
+            return None
+        except Exception as e:
+            logger.error("Error inesperado al obtener hash de Redis (key=%s): %s", key, e)
+            return None
+
+    async def update_hash(self, key: str, updates: dict[str, Any], ttl: int | None = None) -> bool:
+        """
+        Actualiza solo los campos indicados de un hash, sin leer ni reescribir el resto.
+
+        HSET y EXPIRE viajan en un único pipeline transaccional (un solo round-trip).
+        """
+        try:
+            await self._ensure_connection()
+            if self.client is None:
+                return False
+
+            mapping = {field: orjson.dumps(value) for field, value in updates.items()}
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=mapping)
+                pipe.expire(key, ttl or settings.REDIS_TTL)
+                await pipe.execute()
+            return True
+        except (ConnectionError, RedisError) as e:
+            logger.warning("Error al actualizar hash en Redis (key=%s): %s", key, e)
+            return False
+        except Exception as e:
+            logger.error("Error inesperado al actualizar hash en Redis (key=%s): %s", key, e)
+            return False
+
+    async def claim(self, key: str, value: str, ttl: int) -> str:
+        """
+        Reserva una clave de forma atómica (SET NX EX) y retorna el valor que queda guardado:
+        el propio si se reservó, o el de quien la reservó antes.
+
+        Sin Redis disponible retorna el propio valor (la operación continúa sin deduplicar).
+        """
+        try:
+            await self._ensure_connection()
+            if self.client is None:
+                return value
+
+            if await self.client.set(key, value, nx=True, ex=ttl):
+                return value
+            return await self.client.get(key) or value
+        except (ConnectionError, RedisError) as e:
+            logger.warning("Error al reservar clave en Redis (key=%s): %s", key, e)
+            return value
+        except Exception as e:
+            logger.error("Error inesperado al reservar clave en Redis (key=%s): %s", key, e)
+            return value
+
+    async def delete(self, key: str) -> bool:
         """Elimina un valor del caché"""
         try:
-            self._ensure_connection()
+            await self._ensure_connection()
             if self.client is None:
                 return False
 
-            self.client.delete(key)
+            await self.client.delete(key)
             return True
         except (ConnectionError, RedisError) as e:
-            logger.warning(f"Error al eliminar de Redis (key={key}): {str(e)}")
+            logger.warning("Error al eliminar de Redis (key=%s): %s", key, e)
             return False
         except Exception as e:
-            logger.error(f"Error inesperado al eliminar de Redis (key={key}): {str(e)}")
+            logger.error("Error inesperado al eliminar de Redis (key=%s): %s", key, e)
             return False
 
-    def exists(self, key: str) -> bool:
+    async def exists(self, key: str) -> bool:
         """Verifica si una clave existe"""
         try:
-            self._ensure_connection()
+            await self._ensure_connection()
             if self.client is None:
                 return False
 
-            return bool(self.client.exists(key))
+            return bool(await self.client.exists(key))
         except (ConnectionError, RedisError):
             return False
 
-    def close(self):
+    async def close(self):
         """Cierra la conexión con Redis"""
         if self.client is not None:
             try:
-                self.client.close()
+                # El pool se creó aparte: se cierra explícitamente junto con el cliente
+                await self.client.aclose(close_connection_pool=True)
                 logger.info("Conexión con Redis cerrada")
             except Exception as e:
-                logger.error(f"Error al cerrar conexión con Redis: {str(e)}")
+                logger.error("Error al cerrar conexión con Redis: %s", e)
 
 
 # Instancia global del servicio
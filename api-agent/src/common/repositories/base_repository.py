@@ -1,5 +1,6 @@
 from typing import Any, Generic, TypeVar
 
+import sqlalchemy as sa
 from sqlalchemy.orm import Session
 
 from src.common.resilience import retry_db_operation
@@ -18,27 +19,28 @@ class BaseRepository(Generic[ModelType]):
             raise RuntimeError("Model not set. Subclasses must define the 'model' attribute.")
         return self.model
 
-    def _build_query(self, filters: dict[str, Any] | None = None):
+    def _build_select(self, filters: dict[str, Any] | None = None) -> sa.Select:
         model = self._ensure_model()
-        query = self.session.query(model)
+        stmt = sa.select(model)
 
         # Filtrar automáticamente los registros con deleted_at no nulo (soft delete)
         # El mixin SoftDeleteMixin ya maneja esto, pero mantenemos el filtro explícito por seguridad
         if hasattr(model, "deleted_at"):
-            query = query.filter(model.deleted_at.is_(None))
+            stmt = stmt.where(model.deleted_at.is_(None))
 
         if filters:
             for key, value in filters.items():
                 if hasattr(model, key):
-                    query = query.filter(getattr(model, key) == value)
+                    stmt = stmt.where(getattr(model, key) == value)
 
-        return query
+        return stmt
 
     @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def get_all(
         self, skip: int = 0, limit: int = 100, filters: dict[str, Any] | None = None
     ) -> list[ModelType]:
-        return self._build_query(filters).offset(skip).limit(limit).all()
+        stmt = self._build_select(filters).offset(skip).limit(limit)
+        return list(self.session.scalars(stmt))
 
     @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def create(self, entity: ModelType) -> ModelType:
@@ -69,4 +71,8 @@ class BaseRepository(Generic[ModelType]):
 
     @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def count(self, filters: dict[str, Any] | None = None) -> int:
-        return self._build_query(filters).count()
+        # maintain_column_froms conserva el FROM de la entidad aunque no haya filtros
+        stmt = self._build_select(filters).with_only_columns(
+            sa.func.count(), maintain_column_froms=True
+        )
+        return self.session.scalar(stmt)
@@ -7,11 +7,12 @@ from collections.abc import Callable
 from typing import TypeVar
 
 from psycopg2 import OperationalError as Psycopg2OperationalError
-from sqlalchemy.exc import DisconnectionError, OperationalError, TimeoutError
+from sqlalchemy.exc import DBAPIError, DisconnectionError, OperationalError, TimeoutError
 from tenacity import (
     after_log,
     before_sleep_log,
     retry,
+    retry_if_exception,
     retry_if_exception_type,
     stop_after_attempt,
     wait_exponential,
@@ -31,11 +32,27 @@ DB_RETRY_EXCEPTIONS = (
 )
 
 
+def is_transient_db_error(
+    exc: BaseException, retry_on: tuple[type[BaseException], ...] = DB_RETRY_EXCEPTIONS
+) -> bool:
+    """
+    Indica si un error de base de datos es transitorio y vale la pena reintentarlo.
+
+    Se reintentan los tipos de retry_on y cualquier error del driver que invalidó la
+    conexión (p. ej. InterfaceError por una conexión caída). Los errores permanentes
+    (ProgrammingError, DataError, IntegrityError) se propagan de inmediato, sin backoff.
+    """
+    if isinstance(exc, retry_on):
+        return True
+    return isinstance(exc, DBAPIError) and exc.connection_invalidated
+
+
 def retry_db_operation(
     max_attempts: int = 3,
     initial_wait: float = 1.0,
     max_wait: float = 10.0,
     multiplier: float = 2.0,
+    retry_on: tuple[type[BaseException], ...] = DB_RETRY_EXCEPTIONS,
 ):
     """
     Decorador para reintentar operaciones de base de datos que pueden fallar.
@@ -45,6 +62,7 @@ def retry_db_operation(
         initial_wait: Tiempo de espera inicial en segundos (default: 1.0)
         max_wait: Tiempo máximo de espera en segundos (default: 10.0)
         multiplier: Multiplicador para backoff exponencial (default: 2.0)
+        retry_on: Excepciones transitorias que deben ser reintentadas
 
     Returns:
         Decorador que envuelve la función con lógica de retry
@@ -56,7 +74,7 @@ def retry_db_operation(
             min=initial_wait,
             max=max_wait,
         ),
-        retry=retry_if_exception_type(DB_RETRY_EXCEPTIONS),
+        retry=retry_if_exception(lambda exc: is_transient_db_error(exc, retry_on)),
         before_sleep=before_sleep_log(logger, logging.WARNING),
         after=after_log(logger, logging.ERROR),
         reraise=True,
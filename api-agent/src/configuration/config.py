@@ -10,6 +10,10 @@ from sqlalchemy.orm import Session, sessionmaker
 
 class Settings(BaseSettings):
     DATABASE_URL: str = Field(..., description="Database connection URL")
+    DB_POOL_SIZE: int = Field(default=20, description="Persistent connections kept in the DB pool")
+    DB_MAX_OVERFLOW: int = Field(
+        default=10, description="Extra DB connections allowed above the pool size under load"
+    )
     APP_NAME: str = "Agent API"
     APP_VERSION: str = "1.0.0"
     DEBUG: bool = False
@@ -40,6 +44,9 @@ class Settings(BaseSettings):
     REDIS_PASSWORD: str = Field(default="", description="Redis password (empty if no auth)")
     REDIS_DB: int = Field(default=0, description="Redis database number")
     REDIS_TTL: int = Field(default=3600, description="Redis TTL in seconds for conversation cache (default 1 hour)")
+    REDIS_MAX_CONNECTIONS: int = Field(
+        default=50, description="Max connections in the shared Redis pool (per worker process)"
+    )
 
     class Config:
         env_file = str(Path(__file__).parent.parent.parent / ".env")
@@ -59,7 +66,19 @@ Base = declarative_base()
 def get_engine() -> Engine:
     global _engine  # noqa: PLW0603
     if _engine is None:
-        _engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True, echo=settings.DEBUG)
+        _engine = create_engine(
+            settings.DATABASE_URL,
+            pool_pre_ping=True,
+            echo=settings.DEBUG,
+            # Conexiones persistentes reutilizadas entre requests
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            # Filas por sentencia multi-VALUES en los INSERT masivos con RETURNING
+            insertmanyvalues_page_size=1000,
+            # executemany de UPDATE/DELETE agrupado con execute_batch de psycopg2
+            executemany_mode="values_plus_batch",
+            executemany_batch_page_size=500,
+        )
     return _engine
 
 
@@ -3,10 +3,14 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from src.common.mixins.soft_delete_mixin import setup_soft_delete_listeners
+from src.common.rabbitmq_service import get_rabbitmq_service
+from src.common.redis_service import get_redis_service
 from src.configuration.config import settings
 from src.modules.auth.controller import router as auth_router
+from src.modules.conversations.agent.transaction_agent import get_transaction_agent
 from src.modules.conversations.controller import router as conversations_router
 from src.modules.conversations.services.response_consumer_service import ResponseConsumerService
 
@@ -68,11 +72,25 @@ async def lifespan(app: FastAPI):
     # Iniciar consumidor de respuestas de RabbitMQ
     response_consumer = ResponseConsumerService()
     try:
-        response_consumer.start()
+        await response_consumer.start()
         logger.info("Consumidor de respuestas de RabbitMQ iniciado")
     except Exception as e:
         logger.error(f"Error al iniciar consumidor de respuestas: {str(e)}", exc_info=True)
 
+    # Abrir el canal persistente para publicar transferencias
+    rabbitmq_service = get_rabbitmq_service()
+    try:
+        await rabbitmq_service.connect()
+    except Exception as e:
+        logger.error(f"Error al conectar el publicador de RabbitMQ: {str(e)}", exc_info=True)
+
+    # Compilar el grafo del agente y abrir su pool HTTP una sola vez, antes del primer chat
+    try:
+        get_transaction_agent()
+        logger.info("Agente de transacciones inicializado")
+    except ValueError as e:
+        logger.warning(f"Agente de transacciones no inicializado: {str(e)}")
+
     docs_path = app.docs_url or "/docs"
     swagger_url = f"http://{settings.HOST}:{settings.PORT}{docs_path}"
     logger.info("Swagger UI disponible en %s", swagger_url)
@@ -81,11 +99,14 @@ async def lifespan(app: FastAPI):
     
     # Detener consumidor al cerrar la aplicación
     try:
-        response_consumer.stop()
+        await response_consumer.stop()
         logger.info("Consumidor de respuestas de RabbitMQ detenido")
     except Exception as e:
         logger.error(f"Error al detener consumidor de respuestas: {str(e)}")
 
+    await rabbitmq_service.close()
+    await get_redis_service().close()
+
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -95,6 +116,8 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json",
+    # Las respuestas JSON se serializan con orjson
+    default_response_class=ORJSONResponse,
     servers=[
         {
             "url": f"http://localhost:{settings.PORT}",
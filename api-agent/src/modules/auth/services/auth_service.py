@@ -3,7 +3,7 @@ from datetime import UTC, datetime, timedelta
 import bcrypt
 import jwt
 from jwt.exceptions import InvalidTokenError
-from sqlalchemy import or_
+from sqlalchemy import lambda_stmt, or_, select
 from sqlalchemy.orm import Session
 
 from src.configuration.config import settings
@@ -59,9 +59,13 @@ class AuthService:
         """Registra un nuevo usuario."""
         # Verificar si el usuario ya existe
         existing_user = (
-            self.db.query(UserEntity)
-            .filter(
-                or_(UserEntity.username == user_data.username, UserEntity.email == user_data.email)
+            self.db.scalars(
+                select(UserEntity).where(
+                    or_(
+                        UserEntity.username == user_data.username,
+                        UserEntity.email == user_data.email,
+                    )
+                )
             )
             .first()
         )
@@ -88,11 +92,12 @@ class AuthService:
         """Autentica un usuario con username/email y contraseña."""
         # Buscar usuario por username o email
         user = (
-            self.db.query(UserEntity)
-            .filter(
-                or_(
-                    UserEntity.username == login_data.username,
-                    UserEntity.email == login_data.username,
+            self.db.scalars(
+                select(UserEntity).where(
+                    or_(
+                        UserEntity.username == login_data.username,
+                        UserEntity.email == login_data.username,
+                    )
                 )
             )
             .first()
@@ -108,4 +113,6 @@ class AuthService:
 
     def get_user_by_id(self, user_id: int) -> UserEntity | None:
         """Obtiene un usuario por su ID."""
-        return self.db.query(UserEntity).filter(UserEntity.id == user_id).first()
+        # Se ejecuta en cada request autenticado: lambda_stmt compila la sentencia una sola vez
+        stmt = lambda_stmt(lambda: select(UserEntity).where(UserEntity.id == user_id))
+        return self.db.scalars(stmt).first()
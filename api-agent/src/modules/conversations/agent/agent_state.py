@@ -1,10 +1,38 @@
-from typing import TypedDict
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Annotated, TypedDict
+
+# Mensajes de historial que se conservan en el estado (y que ve el LLM)
+MAX_HISTORY_MESSAGES = 10
+
+
+@dataclass(slots=True)
+class Msg:
+    """Mensaje del historial del agente; se convierte a dict solo al salir del agente"""
+
+    role: str
+    content: str
+
+
+def add_messages(current: deque[Msg], new: Iterable[Msg]) -> deque[Msg]:
+    """
+    Reducer del historial: los nodos devuelven solo sus mensajes nuevos y se agregan
+    al deque acotado en O(1), sin copiar el estado.
+    """
+    if current.maxlen != MAX_HISTORY_MESSAGES:
+        # LangGraph inicializa el canal con un deque sin límite
+        current = deque(current, maxlen=MAX_HISTORY_MESSAGES)
+    current.extend(new)
+    return current
 
 
 class AgentState(TypedDict):
-    messages: list[dict]
+    messages: Annotated[deque[Msg], add_messages]
+    last_user_message: str
     recipient_phone: str | None
     amount: float | None
+    amount_display: str | None
     currency: str
     confirmation_pending: bool
     transaction_id: str | None
@@ -1,23 +1,115 @@
-import uuid
+import asyncio
 import json
+import logging
+import re
+import threading
+import uuid
+from collections import deque
+from collections.abc import AsyncIterator, Sequence
 from typing import Any
+from uuid import UUID
 
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
 from langgraph.graph import END, StateGraph
 
 from src.configuration.config import settings
 from src.common.rabbitmq_service import get_rabbitmq_service
 from src.common.redis_service import get_redis_service
-from src.modules.conversations.agent.agent_state import AgentState
-from src.modules.conversations.utils.validators import (
+from src.modules.conversations.agent.agent_state import (
+    MAX_HISTORY_MESSAGES,
+    AgentState,
+    Msg,
+    add_messages,
+)
+from src.modules.conversations.utils.validators import is_transfer_related, scan_message
+
+logger = logging.getLogger(__name__)
+
+SPANISH_LANGUAGE_ENFORCEMENT = "Responde EXCLUSIVAMENTE en ESPAÑOL."
+DENY_WORDS = ("no", "cancelar", "cancel", "nope")
+CANCELLED_MESSAGE = "Transferencia cancelada. ¿Quieres hacer otra transferencia?"
 
-    is_transfer_related,
+SYSTEM_PROMPT = """Eres un asistente amigable para transferencias de dinero.
+                    INSTRUCCIONES:
+                    - Sé natural y conversacional
+                    - Ayuda con transferencias de dinero
+                    - Recopila teléfono (10 dígitos) y monto (positivo)
+                    - Solo solicita confirmación cuando tengas AMBOS datos
 
+                    CUANDO TENGAS AMBOS DATOS:
+                    - Pide EXPLÍCITAMENTE que escriba "confirmo"
+                    - Ejemplo: "Para proceder, escribe CONFIRMO"
+                    - No uses otras variaciones"""
+# Prefijo idéntico en todas las llamadas de respuesta (cacheable por el proveedor)
+_STATIC_PROMPT_MESSAGES = (
+    SystemMessage(content=SPANISH_LANGUAGE_ENFORCEMENT),
+    SystemMessage(content=SYSTEM_PROMPT),
 )
 
-SPANISH_LANGUAGE_ENFORCEMENT = "Responde EXCLUSIVAMENTE en ESPAÑOL."
-DENY_WORDS = ["no", "cancelar", "cancel", "nope"]
+# Una sola pasada del motor de regex, sin copias intermedias del mensaje
+_DENY_RE = re.compile(r"\b(?:" + "|".join(DENY_WORDS) + r")\b", re.IGNORECASE)
+_CONFIRM_RE = re.compile(r"\s*confirmo\s*$", re.IGNORECASE)
+
+# Contexto del turno precalculado por estado: (confirmación pendiente, hay teléfono, hay monto).
+# Solo se rellenan el teléfono y el monto en cada llamada
+_CONTEXT_TEMPLATES: dict[tuple[bool, bool, bool], str] = {
+    (True, True, True): (
+        "[Contexto: Esperando que el usuario escriba 'confirmo' para transferir "
+        "{amount} al {phone}]"
+    ),
+    (False, True, True): (
+        "[Contexto CRÍTICO: Tienes teléfono {phone} y monto {amount}. "
+        "DEBES pedir confirmación explícita]"
+    ),
+    (False, True, False): "[Contexto: Tienes teléfono {phone}. Necesitas el monto]",
+    (False, False, True): "[Contexto: Tienes monto {amount}. Necesitas el teléfono]",
+    (False, False, False): (
+        "[Contexto: Saluda amablemente y pregunta cómo puedes ayudar con transferencias]"
+    ),
+}
+
+# Ventana en la que un "confirmo" repetido de la misma transferencia no se vuelve a publicar
+TRANSACTION_DEDUP_TTL_SECONDS = 60
+
+# Tag de las llamadas al LLM cuya salida se muestra al usuario (se emiten en streaming)
+REPLY_TAG = "agent_reply"
+
+
+def _format_amount(amount: float | None) -> str | None:
+    """Formatea el monto como "$1,000 COP"; se calcula una vez por cambio de monto"""
+    return f"${amount:,.0f} COP" if amount else None
+
+
+class _ReplyTokenHandler(BaseCallbackHandler):
+    """Reenvía los tokens de las respuestas al usuario a una cola del event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue[str | None]):
+        self.loop = loop
+        self.queue = queue
+        self.last_text = ""
+        self._run_id: UUID | None = None
+
+    def on_llm_new_token(
+        self, token: str, *, run_id: UUID, tags: list[str] | None = None, **kwargs: Any
+    ) -> None:
+        if not token or REPLY_TAG not in (tags or []):
+            return
+
+        separator = ""
+        if run_id != self._run_id:
+            # Nueva respuesta dentro del mismo turno: separarla de la anterior
+            if self._run_id is not None:
+                separator = "\n\n"
+            self._run_id = run_id
+            self.last_text = ""
+
+        self.last_text += token
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, separator + token)
+
 
 class TransactionAgent:
     def __init__(self, openai_api_key: str | None = None):
@@ -25,22 +117,33 @@ class TransactionAgent:
         if not api_key:
             raise ValueError("OPENAI_API_KEY no configurada")
 
-        self.llm = ChatOpenAI(model=settings.OPENAI_MODEL, temperature=1.0, api_key=api_key)
+        self.llm = ChatOpenAI(
+            model=settings.OPENAI_MODEL,
+            temperature=1.0,
+            api_key=api_key,
+            streaming=True,
+            # HTTP/2: las llamadas concurrentes de todos los chats se multiplexan
+            # sobre las mismas conexiones en lugar de abrir una por request
+            http_async_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+            ),
+        )
+        self.reply_llm = self.llm.with_config(tags=[REPLY_TAG])
         self.redis_service = get_redis_service()
         self.graph = self._build_graph()
 
     @staticmethod
-    def _get_last_user_message(messages: list[dict[str, Any]]) -> str | None:
-        for msg in reversed(messages):
-            if msg.get("role") == "user":
-                return msg.get("content", "")
+    def _get_last_assistant_message(messages: Sequence[Msg]) -> str | None:
+        # Cada nodo agrega su respuesta al final del historial: basta con mirar la cola
+        if messages and messages[-1].role == "assistant":
+            return messages[-1].content
         return None
 
     def _build_graph(self) -> StateGraph:
         workflow = StateGraph(AgentState)
 
         workflow.add_node("process_message", self._process_message)
-        workflow.add_node("extract_info", self._extract_info)
         workflow.add_node("check_confirmation", self._check_confirmation)
         workflow.add_node("execute_transaction", self._execute_transaction)
 
@@ -48,8 +151,12 @@ class TransactionAgent:
 
         workflow.add_conditional_edges(
             "process_message",
-            self._should_check_confirmation,
-            {"check_confirmation": "check_confirmation", "continue": "extract_info"},
+            self._after_process_message,
+            {
+                "need_confirmation": "check_confirmation",
+                "continue": END,
+                "confirmation_requested": END,
+            },
         )
         
         workflow.add_conditional_edges(
@@ -58,18 +165,12 @@ class TransactionAgent:
             {"yes": "execute_transaction", "no": END, "waiting": END},
         )
         
-        workflow.add_conditional_edges(
-            "extract_info",
-            self._after_extraction,
-            {"need_confirmation": "check_confirmation", "continue": END},
-        )
-        
         workflow.add_edge("execute_transaction", END)
 
         return workflow.compile()
 
     def _should_check_confirmation(self, state: AgentState) -> str:
-        last_user_message = self._get_last_user_message(state.get("messages", []))
+        last_user_message = state.get("last_user_message")
         confirmation_pending = state.get("confirmation_pending", False)
         
         # Si hay confirmación pendiente, ir a verificar
@@ -82,88 +183,104 @@ class TransactionAgent:
         
         if recipient_phone and amount and last_user_message:
             # Solo considerar "confirmo" si realmente tenemos datos completos
-            if last_user_message.strip().lower() == "confirmo":
+            if _CONFIRM_RE.match(last_user_message):
                 return "check_confirmation"
         
         return "continue"
 
-    def _process_message(self, state: AgentState) -> dict[str, Any]:
+    def _after_process_message(self, state: AgentState) -> str:
+        # La respuesta de este turno ya pidió la confirmación con los datos que se tenían
+        if state.get("confirmation_pending", False):
+            return "confirmation_requested"
+        return self._after_extraction(state)
+
+    async def _process_message(self, state: AgentState, config: RunnableConfig) -> dict[str, Any]:
         messages = state.get("messages", [])
-        last_user_message = self._get_last_user_message(messages)
+        last_user_message = state.get("last_user_message")
         
         # Si hay confirmación pendiente, no procesar con LLM
         if state.get("confirmation_pending", False):
-            return state
+            return {}
 
-        # Validar si es sobre transferencias
-        if last_user_message and not is_transfer_related(last_user_message):
+        # Validar si es sobre transferencias. Con teléfono o monto ya recopilados la
+        # conversación es de transferencias: no hace falta clasificar el tema
+        in_flight = bool(state.get("recipient_phone") or state.get("amount"))
+        if last_user_message and not in_flight and not is_transfer_related(last_user_message):
             response = "Solo puedo ayudarte con transferencias de dinero. ¿Te gustaría hacer una transferencia?"
-            return {
-                "messages": [*messages, {"role": "assistant", "content": response}],
-                **{k: v for k, v in state.items() if k != "messages"}
-            }
+            return {"messages": [Msg("assistant", response)]}
 
-        # Procesar con LLM
-        system_prompt = self._get_system_prompt(state)
-        conversation_messages = [
-            SystemMessage(content=SPANISH_LANGUAGE_ENFORCEMENT),
-            SystemMessage(content=system_prompt),
-        ]
+        # Procesar con LLM: instrucciones fijas primero y el contexto del turno al final,
+        # así el prefijo del prompt se repite entre turnos y OpenAI puede reutilizarlo
+        conversation_messages = list(_STATIC_PROMPT_MESSAGES)
 
-        for msg in messages[-10:]:
-            role = msg.get("role")
-            content = msg.get("content", "")
+        for msg in messages:
+            role = msg.role
+            content = msg.content
             if role == "user":
                 conversation_messages.append(HumanMessage(content=content))
             elif role == "assistant":
                 conversation_messages.append(AIMessage(content=content))
 
-        response = self.llm.invoke(conversation_messages)
+        conversation_messages.append(SystemMessage(content=self._get_context_prompt(state)))
 
-        return {
-            "messages": [*messages, {"role": "assistant", "content": response.content}],
-            **{k: v for k, v in state.items() if k != "messages"}
-        }
+        # Con ambos datos, esta misma respuesta sirve como solicitud de confirmación
+        if state.get("recipient_phone") and state.get("amount"):
+            response = await self.reply_llm.ainvoke(conversation_messages, config)
+            return {
+                "messages": [
+                    Msg("assistant", response.content),
+                    *self._request_confirmation(state, response.content),
+                ],
+                "confirmation_pending": True,
+            }
+
+        # La respuesta solo usa los datos previos y la extracción no usa la respuesta:
+        # ambas llamadas al LLM viajan en paralelo
+        response, extracted_data = await asyncio.gather(
+            self.reply_llm.ainvoke(conversation_messages, config),
+            self._extract_info(state),
+        )
+        return {"messages": [Msg("assistant", response.content)], **extracted_data}
+
+    def _request_confirmation(self, state: AgentState, last_reply: str | None) -> list[Msg]:
+        """
+        Mensajes necesarios para que la respuesta pida escribir "confirmo", sin otra llamada
+        al LLM: ninguno si la última respuesta ya lo pide.
+        """
+        if last_reply and "confirmo" in last_reply.lower():
+            return []
+
+        amount_display = state.get("amount_display") or _format_amount(state.get("amount"))
+        return [
+            Msg(
+                "assistant",
+                f"Vas a transferir {amount_display} al {state.get('recipient_phone')}. "
+                "Para proceder, escribe CONFIRMO.",
+            )
+        ]
 
-    def _get_system_prompt(self, state: AgentState) -> str:
+    def _get_context_prompt(self, state: AgentState) -> str:
         recipient_phone = state.get("recipient_phone")
         amount = state.get("amount")
-        confirmation_pending = state.get("confirmation_pending", False)
-
-        prompt = """Eres un asistente amigable para transferencias de dinero.
-                    INSTRUCCIONES:
-                    - Sé natural y conversacional
-                    - Ayuda con transferencias de dinero
-                    - Recopila teléfono (10 dígitos) y monto (positivo)
-                    - Solo solicita confirmación cuando tengas AMBOS datos
-
-                    CUANDO TENGAS AMBOS DATOS:
-                    - Pide EXPLÍCITAMENTE que escriba "confirmo"
-                    - Ejemplo: "Para proceder, escribe CONFIRMO"
-                    - No uses otras variaciones"""
-
-        if confirmation_pending and recipient_phone and amount:
-            prompt += f"\n\n[Contexto: Esperando que el usuario escriba 'confirmo' para transferir ${amount:,.0f} COP al {recipient_phone}]"
-        elif recipient_phone and amount:
-            prompt += f"\n\n[Contexto CRÍTICO: Tienes teléfono {recipient_phone} y monto ${amount:,.0f} COP. DEBES pedir confirmación explícita]"
-        elif recipient_phone:
-            prompt += f"\n[Contexto: Tienes teléfono {recipient_phone}. Necesitas el monto]"
-        elif amount:
-            prompt += f"\n[Contexto: Tienes monto ${amount:,.0f} COP. Necesitas el teléfono]"
-        else:
-            prompt += "\n[Contexto: Saluda amablemente y pregunta cómo puedes ayudar con transferencias]"
-
-        return prompt
-
-    def _extract_info(self, state: AgentState) -> dict[str, Any]:
-        messages = state.get("messages", [])
-        last_user_message = self._get_last_user_message(messages)
+        key = (
+            bool(state.get("confirmation_pending")) and bool(recipient_phone and amount),
+            bool(recipient_phone),
+            bool(amount),
+        )
+        template = _CONTEXT_TEMPLATES[key]
+        if not (recipient_phone or amount):
+            return template
+        amount_display = state.get("amount_display") or _format_amount(amount)
+        return template.format(phone=recipient_phone, amount=amount_display)
+
+    async def _extract_info(self, state: AgentState) -> dict[str, Any]:
+        last_user_message = state.get("last_user_message")
         conversation_id = state.get("conversation_id")
         user_id = state.get("user_id")
         
         if not last_user_message:
             return {}
-        
+
         extraction_prompt = f"""Analiza el siguiente mensaje del usuario y extrae SOLO los datos que se solicitan.
                                 Mensaje: "{last_user_message}"
                                 INSTRUCCIONES:
@@ -194,7 +311,7 @@ class TransactionAgent:
             SystemMessage(content=extraction_prompt),
         ]
             
-        response = self.llm.invoke(conversation_messages)
+        response = await self.llm.ainvoke(conversation_messages)
         response_content = response.content.strip()
         
         # Limpiar la respuesta si tiene markdown code blocks
@@ -203,18 +320,28 @@ class TransactionAgent:
             lines = response_content.split('\n')
             response_content = '\n'.join([line for line in lines if not line.startswith('```')])
         
-        # Parsear JSON
-        extracted_data = json.loads(response_content)
-        redis_key = f"conversation:{conversation_id}"
-        
-        redis_data = {
-            "recipient_phone": extracted_data.get("recipient_phone"),
-            "amount": extracted_data.get("amount"),
-            "conversation_id": conversation_id,
-            "user_id": user_id,
+        # Parsear JSON; si el LLM no devuelve un JSON válido se analiza el mensaje por regex
+        # (solo en este caso: el análisis no corre en cada turno)
+        try:
+            llm_data = json.loads(response_content)
+        except json.JSONDecodeError:
+            logger.warning("Extracción del LLM no es JSON válido, se usa el análisis por regex")
+            scan = scan_message(last_user_message, check_topic=False)
+            llm_data = {"recipient_phone": scan.phone, "amount": scan.amount}
+
+        # Solo los datos encontrados: un campo ausente no borra lo que ya se tenía
+        extracted_data = {
+            key: llm_data.get(key)
+            for key in ("recipient_phone", "amount")
+            if llm_data.get(key) is not None
         }
-        if(extracted_data.get("recipient_phone") is not None and extracted_data.get("amount") is not None):
-            self.redis_service.set(redis_key, redis_data)
+        if extracted_data:
+            # Los campos se guardan en un hash: solo se escribe lo extraído, sin leer lo previo
+            redis_key = f"conversation_state:{conversation_id}"
+            redis_data = {**extracted_data, "conversation_id": conversation_id, "user_id": user_id}
+            await self.redis_service.update_hash(redis_key, redis_data)
+        if "amount" in extracted_data:
+            extracted_data["amount_display"] = _format_amount(extracted_data["amount"])
         return extracted_data
 
         
@@ -224,75 +351,57 @@ class TransactionAgent:
             return "need_confirmation"
         return "continue"
 
-    def _check_confirmation(self, state: AgentState) -> dict[str, Any]:
+    async def _check_confirmation(self, state: AgentState) -> dict[str, Any]:
         if state.get("recipient_phone") and state.get("amount") and not state.get("confirmation_pending"):
-            messages = state.get("messages", [])
-            last_assistant_message = None
-            
-            for msg in reversed(messages):
-                if msg.get("role") == "assistant":
-                    last_assistant_message = msg.get("content", "")
-                    break
-            
-            if not last_assistant_message or "confirmo" not in last_assistant_message.lower():
-                system_prompt = self._get_system_prompt(state)
-                conversation_messages = [
-                    SystemMessage(content=SPANISH_LANGUAGE_ENFORCEMENT),
-                    SystemMessage(content=system_prompt),
-                ]
-
-                for msg in messages[-10:]:
-                    role = msg.get("role")
-                    content = msg.get("content", "")
-                    if role == "user":
-                        conversation_messages.append(HumanMessage(content=content))
-                    elif role == "assistant":
-                        conversation_messages.append(AIMessage(content=content))
-
-                response = self.llm.invoke(conversation_messages)
-                
-                return {
-                    "messages": [*messages, {"role": "assistant", "content": response.content}],
-                    "recipient_phone": state.get("recipient_phone"),
-                    "amount": state.get("amount"),
-                    "confirmation_pending": True,
-                    "currency": state.get("currency", "COP"),
-                    "transaction_id": state.get("transaction_id"),
-                    "user_id": state.get("user_id"),
-                    "conversation_id": state.get("conversation_id"),
-                }
+            # La respuesta del turno ya se generó en process_message; solo falta pedir "confirmo"
+            last_reply = self._get_last_assistant_message(state.get("messages", []))
+            return {
+                "messages": self._request_confirmation(state, last_reply),
+                "confirmation_pending": True,
+            }
         
-        return state
+        return {}
 
     def _is_confirmed(self, state: AgentState) -> str:
-        last_user_message = self._get_last_user_message(state.get("messages", []))
+        last_user_message = state.get("last_user_message")
         
         if not last_user_message:
             return "waiting"
 
-        cleaned_message = last_user_message.strip().lower()
-
-        if cleaned_message == "confirmo":
+        if _CONFIRM_RE.match(last_user_message):
             return "yes"
-        
-        if any(word in cleaned_message for word in DENY_WORDS):
+
+        if _DENY_RE.search(last_user_message):
             return "no"
 
         return "waiting"
 
-    def _execute_transaction(self, state: AgentState) -> dict[str, Any]:
+    async def _execute_transaction(self, state: AgentState) -> dict[str, Any]:
         transaction_id = f"TXN-{uuid.uuid4().hex[:8].upper()}"
         recipient_phone = state.get("recipient_phone")
         amount = state.get("amount")
-        messages = state.get("messages", [])
+        amount_display = state.get("amount_display") or _format_amount(amount)
 
         if not recipient_phone or not amount:
             error_message = "Necesito tanto el número de teléfono como el monto para ejecutar la transferencia."
-            return {
-                "messages": [*messages, {"role": "assistant", "content": error_message}],
-                "confirmation_pending": False,
-                **{k: v for k, v in state.items() if k not in ["messages", "confirmation_pending"]}
-            }
+            return {"messages": [Msg("assistant", error_message)], "confirmation_pending": False}
+
+        # Un "confirmo" repetido (doble envío o reintento) reutiliza la transacción ya publicada.
+        # SET NX es atómico en Redis, así que vale también entre workers concurrentes
+        conversation_id = state.get("conversation_id")
+        if conversation_id:
+            claimed_id = await self.redis_service.claim(
+                f"transaction_lock:{conversation_id}:{recipient_phone}:{amount}",
+                transaction_id,
+                TRANSACTION_DEDUP_TTL_SECONDS,
+            )
+            if claimed_id != transaction_id:
+                logger.info("Transferencia duplicada ignorada: transaction_id=%s", claimed_id)
+                return self._transaction_result(
+                    f"Tu solicitud de transferencia de {amount_display} al {recipient_phone} "
+                    f"ya está siendo procesada. ID: {claimed_id}.",
+                    claimed_id,
+                )
 
         # Enviar a RabbitMQ
         try:
@@ -309,35 +418,94 @@ class TransactionAgent:
             if state.get("user_id"):
                 transfer_data["user_id"] = state.get("user_id")
 
-            get_rabbitmq_service().send_transfer(transfer_data)
-                        # No mostrar éxito inmediatamente - el resultado real vendrá en la respuesta asíncrona
-            success_message = f"Tu solicitud de transferencia de ${amount:,.0f} COP al {recipient_phone} está siendo procesada. ID: {transaction_id}. Te notificaré cuando se complete."
-            
+            # El ACK del broker se espera sin bloquear el event loop: los demás chats siguen avanzando
+            sent = await get_rabbitmq_service().send_transfer(transfer_data)
         except Exception:
+            sent = False
+
+        if sent:
+            # No mostrar éxito inmediatamente - el resultado real vendrá en la respuesta asíncrona
+            success_message = f"Tu solicitud de transferencia de {amount_display} al {recipient_phone} está siendo procesada. ID: {transaction_id}. Te notificaré cuando se complete."
+        else:
             success_message = f"Tu solicitud ha sido registrada (ID: {transaction_id}), pero hubo un problema al procesarla."
 
+        return self._transaction_result(success_message, transaction_id)
+
+    def _transaction_result(self, message: str, transaction_id: str) -> dict[str, Any]:
+        """Actualización del estado tras ejecutar una transferencia: se limpian sus datos"""
         return {
-            "messages": [*messages, {"role": "assistant", "content": success_message}],
+            "messages": [Msg("assistant", message)],
             "recipient_phone": None,
             "amount": None,
+            "amount_display": None,
             "confirmation_pending": False,
             "transaction_id": transaction_id,
-            "user_id": state.get("user_id"),
-            "conversation_id": state.get("conversation_id"),
         }
 
-    def process(
-        self, user_message: str, conversation_state: dict[str, Any] | None = None
+    async def _run_fast_path(self, state: AgentState) -> AgentState | None:
+        """
+        Resuelve sin pasar por el grafo los turnos deterministas: confirmación pendiente
+        o "confirmo" con teléfono y monto completos. Ninguno necesita el LLM: la respuesta
+        (transferencia en proceso, cancelación o recordatorio) sale de una plantilla.
+
+        Retorna None cuando el turno debe procesarse con el grafo.
+        """
+        if self._should_check_confirmation(state) != "check_confirmation":
+            return None
+
+        decision = self._is_confirmed(state)
+        if decision == "yes":
+            update = await self._execute_transaction(state)
+        elif decision == "no":
+            update = {
+                "messages": [Msg("assistant", CANCELLED_MESSAGE)],
+                "recipient_phone": None,
+                "amount": None,
+                "amount_display": None,
+                "confirmation_pending": False,
+            }
+        else:
+            # Sigue pendiente: recordar la transferencia en lugar de repetir la respuesta anterior
+            amount_display = state.get("amount_display") or _format_amount(state.get("amount"))
+            reminder = (
+                f"Tienes pendiente transferir {amount_display} al "
+                f"{state.get('recipient_phone')}. Escribe CONFIRMO para continuar o CANCELAR "
+                "para cancelar."
+            )
+            update = {"messages": [Msg("assistant", reminder)]}
+
+        # Mismo merge que haría el grafo: el historial pasa por su reducer, el resto se reemplaza
+        return {
+            **state,
+            **update,
+            "messages": add_messages(state["messages"], update["messages"]),
+        }
+
+    async def process(
+        self,
+        user_message: str,
+        conversation_state: dict[str, Any] | None = None,
+        callbacks: list[BaseCallbackHandler] | None = None,
     ) -> dict[str, Any]:
         conversation_state = conversation_state or {}
 
+        # El deque acota el historial: los nodos agregan en O(1) sin volver a recortar
+        messages = deque(
+            (
+                Msg(msg["role"], msg.get("content", ""))
+                for msg in conversation_state.get("messages", [])
+            ),
+            maxlen=MAX_HISTORY_MESSAGES,
+        )
+        messages.append(Msg("user", user_message))
+
         initial_state: AgentState = {
-            "messages": [
-                *conversation_state.get("messages", []),
-                {"role": "user", "content": user_message},
-            ],
+            "messages": messages,
+            "last_user_message": user_message,
             "recipient_phone": conversation_state.get("recipient_phone"),
             "amount": conversation_state.get("amount"),
+            # Formateado una vez por turno; los nodos reutilizan el texto
+            "amount_display": _format_amount(conversation_state.get("amount")),
             "currency": conversation_state.get("currency", "COP"),
             "confirmation_pending": conversation_state.get("confirmation_pending", False),
             "transaction_id": conversation_state.get("transaction_id"),
@@ -345,15 +513,22 @@ class TransactionAgent:
             "conversation_id": conversation_state.get("conversation_id"),
         }
 
-        final_state = self.graph.invoke(initial_state)
+        logger.debug(
+            "Estado actual: phone=%s amount=%s confirmation_pending=%s",
+            initial_state["recipient_phone"],
+            initial_state["amount"],
+            initial_state["confirmation_pending"],
+        )
+
+        final_state = await self._run_fast_path(initial_state)
+        if final_state is None:
+            final_state = await self.graph.ainvoke(
+                initial_state, config={"callbacks": callbacks} if callbacks else None
+            )
         messages = final_state.get("messages", [])
 
-        # Obtener el último mensaje del asistente
-        last_assistant_message = None
-        for msg in reversed(messages):
-            if msg.get("role") == "assistant":
-                last_assistant_message = msg.get("content", "")
-                break
+        # Obtener la respuesta del asistente de este turno
+        last_assistant_message = self._get_last_assistant_message(messages)
 
         return {
             "response": last_assistant_message or "Lo siento, no pude procesar tu mensaje.",
@@ -365,6 +540,62 @@ class TransactionAgent:
                 "transaction_id": final_state.get("transaction_id"),
                 "user_id": final_state.get("user_id"),
                 "conversation_id": final_state.get("conversation_id"),
-                "messages": messages[-10:],
+                "messages": [{"role": msg.role, "content": msg.content} for msg in messages],
             },
-        }
\ No newline at end of file
+        }
+
+    async def astream(
+        self, user_message: str, conversation_state: dict[str, Any] | None = None
+    ) -> AsyncIterator[str | dict[str, Any]]:
+        """
+        Procesa el mensaje emitiendo los tokens de la respuesta a medida que llegan.
+
+        Produce fragmentos de texto (str) y, al final, el mismo diccionario que process().
+
+        Si el generador se cierra antes de terminar (el cliente SSE se desconectó), el turno
+        se cancela: quien llama ya no recibiría el resultado para guardarlo. Un "confirmo"
+        reenviado tras la desconexión reutiliza la transacción ya publicada (lock de Redis).
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[str | None] = asyncio.Queue()
+        handler = _ReplyTokenHandler(loop, queue)
+
+        task = asyncio.ensure_future(self.process(user_message, conversation_state, [handler]))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+
+        try:
+            while (token := await queue.get()) is not None:
+                yield token
+
+            result = await task
+            # Respuestas que no vienen del LLM (validaciones, transacciones) se envían completas
+            if result["response"] != handler.last_text:
+                yield ("\n\n" if handler.last_text else "") + result["response"]
+            yield result
+        finally:
+            if not task.done():
+                task.cancel()
+                # Esperar la cancelación y recuperar su excepción (sin "never retrieved")
+                await asyncio.gather(task, return_exceptions=True)
+            elif not task.cancelled():
+                task.exception()
+
+
+# Agentes compartidos por API key: el grafo se compila y el pool HTTP se abre una sola vez
+_transaction_agents: dict[str, TransactionAgent] = {}
+# Los servicios se construyen también desde el threadpool (endpoints síncronos): sin el lock,
+# dos requests con la caché fría crearían dos agentes y el pool HTTP del perdedor nunca se cerraría
+_transaction_agents_lock = threading.Lock()
+
+
+def get_transaction_agent(openai_api_key: str | None = None) -> TransactionAgent:
+    """Obtiene la instancia global del agente para la API key (por defecto la de settings)"""
+    api_key = openai_api_key or settings.OPENAI_API_KEY
+    agent = _transaction_agents.get(api_key)
+    if agent is None:
+        with _transaction_agents_lock:
+            agent = _transaction_agents.get(api_key)
+            if agent is None:
+                agent = TransactionAgent(api_key)
+                _transaction_agents[api_key] = agent
+    return agent
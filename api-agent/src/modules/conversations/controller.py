@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from src.common.repositories import get_db
@@ -11,6 +12,7 @@ from src.modules.conversations.dtos.conversation import (
     ConversationCreate,
     ConversationResponse,
     ConversationUpdate,
+    MessageResponse,
 )
 from src.modules.conversations.services.conversations_service import ConversationsService
 
@@ -147,6 +149,55 @@ def get_conversation(
     return conversation
 
 
+@router.get(
+    "/{conversation_id}/messages",
+    response_model=list[MessageResponse],
+    summary="Get the messages of a conversation",
+    description="Gets the messages of a conversation in creation order, paginated by keyset: pass the id of the last message received as 'after_id' to get the next page.",
+    responses={
+        200: {
+            "description": "Messages retrieved successfully",
+            "content": {
+                "application/json": {
+                    "example": [
+                        {
+                            "id": 10,
+                            "role": "user",
+                            "content": "quiero enviar 100 al 3001234567",
+                            "created_at": "2024-01-15T10:31:00",
+                        }
+                    ]
+                }
+            },
+        },
+        401: {"description": "No autenticado"},
+        404: {"description": "Conversation not found"},
+    },
+)
+def get_conversation_messages(
+    conversation_id: int,
+    after_id: int | None = None,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    _current_user: UserEntity = Depends(get_current_user),
+):
+    """
+    Get the messages of a conversation, oldest first.
+
+    - **conversation_id**: Unique ID of the conversation
+    - **after_id**: ID of the last message of the previous page (optional)
+    - **limit**: Maximum number of messages to return (max 100)
+    """
+    service = ConversationsService(db)
+    messages = service.get_messages(conversation_id, after_id=after_id, limit=min(limit, 100))
+    if messages is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Conversation with ID {conversation_id} not found",
+        )
+    return messages
+
+
 @router.put(
     "/{conversation_id}",
     response_model=ConversationResponse,
@@ -221,11 +272,37 @@ def update_conversation(
         422: {"description": "Data validation error"},
     },
 )
-def chat(
+async def chat(
     chat_message: ChatMessage,
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user_id),
 ):
 
     service = ConversationsService(db, settings.OPENAI_API_KEY)
-    return service.process_chat_message(chat_message, str(user_id))
+    return await service.process_chat_message(chat_message, str(user_id))
+
+
+@router.post(
+    "/chat/stream",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Send a chat message (streaming)",
+    description="Same as /chat, but the agent response is streamed as Server-Sent Events while it is generated: 'token' events carry text fragments (JSON strings) and a final 'done' event carries the full ChatResponse. The conversation ID is also returned in the X-Conversation-Id header.",
+    responses={
+        200: {"description": "Agent response streamed as SSE", "content": {"text/event-stream": {}}},
+        401: {"description": "No autenticado"},
+        422: {"description": "Data validation error"},
+    },
+)
+def chat_stream(
+    chat_message: ChatMessage,
+    db: Session = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+):
+    service = ConversationsService(db, settings.OPENAI_API_KEY)
+    conversation = service.resolve_conversation(chat_message, str(user_id))
+    return StreamingResponse(
+        service.stream_chat_message(conversation, chat_message.message, str(user_id)),
+        media_type="text/event-stream",
+        headers={"X-Conversation-Id": str(conversation.id), "Cache-Control": "no-cache"},
+    )
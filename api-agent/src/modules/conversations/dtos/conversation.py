@@ -1,7 +1,6 @@
 from datetime import datetime
-from typing import ClassVar
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 from src.common.enums.conversation_status import ConversationStatus
 
@@ -33,8 +32,10 @@ class ConversationCreate(BaseModel):
         default=ConversationStatus.ACTIVE,
     )
 
-    class Config:
-        json_schema_extra: ClassVar[dict] = {"example": {"user_id": "user_123", "status": "active"}}
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={"example": {"user_id": "user_123", "status": "active"}},
+    )
 
 
 class ConversationUpdate(BaseModel):
@@ -73,8 +74,10 @@ class ConversationUpdate(BaseModel):
         description="ID de la transacción completada",
     )
 
-    class Config:
-        json_schema_extra: ClassVar[dict] = {"example": {"status": "completed", "ended_at": "2024-01-15T11:00:00"}}
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={"example": {"status": "completed", "ended_at": "2024-01-15T11:00:00"}},
+    )
 
 
 class ConversationResponse(ConversationBase):
@@ -82,9 +85,9 @@ class ConversationResponse(ConversationBase):
     created_at: datetime = Field(...)
     updated_at: datetime | None = Field(None)
 
-    class Config:
-        from_attributes = True
-        json_schema_extra: ClassVar[dict] = {
+    model_config = ConfigDict(
+        from_attributes=True,
+        json_schema_extra={
             "example": {
                 "id": 1,
                 "user_id": "user_123",
@@ -94,7 +97,27 @@ class ConversationResponse(ConversationBase):
                 "created_at": "2024-01-15T10:30:00",
                 "updated_at": None,
             }
-        }
+        },
+    )
+
+
+class MessageResponse(BaseModel):
+    id: int = Field(..., description="ID del mensaje (cursor para la página siguiente)")
+    role: str = Field(..., description="Autor del mensaje (user o assistant)")
+    content: str = Field(..., description="Contenido del mensaje")
+    created_at: datetime = Field(...)
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        json_schema_extra={
+            "example": {
+                "id": 10,
+                "role": "user",
+                "content": "quiero enviar 100 al 3001234567",
+                "created_at": "2024-01-15T10:31:00",
+            }
+        },
+    )
 
 
 class ChatMessage(BaseModel):
@@ -104,23 +127,43 @@ class ChatMessage(BaseModel):
         description="ID de la conversación (opcional, se creará una nueva si no se proporciona)",
     )
 
-    class Config:
-        json_schema_extra: ClassVar[dict] = {
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={
             "example": {"message": "Hola, ¿cómo puedo ayudarte?", "conversation_id": 1}
-        }
+        },
+    )
+
+
+class ChatStateMessage(BaseModel):
+    role: str = Field(..., description="Autor del mensaje (user o assistant)")
+    content: str = Field(..., description="Contenido del mensaje")
+
+
+class ChatState(BaseModel):
+    recipient_phone: str | None = Field(None, description="Número de teléfono del destinatario")
+    amount: float | None = Field(None, description="Monto a transferir")
+    currency: str = Field("COP", description="Moneda")
+    confirmation_pending: bool = Field(False, description="Si hay una confirmación pendiente")
+    transaction_id: str | None = Field(None, description="ID de la transacción completada")
+    user_id: str | None = Field(None, description="ID del usuario")
+    conversation_id: int | None = Field(None, description="ID de la conversación")
+    messages: list[ChatStateMessage] = Field(
+        default_factory=list, description="Historial reciente de la conversación"
+    )
 
 
 class ChatResponse(BaseModel):
     conversation_id: int = Field(..., description="ID de la conversación")
     response: str = Field(..., description="Respuesta del agente")
     status: ConversationStatus = Field(..., description="Estado actual de la conversación")
-    state: dict | None = Field(
+    state: ChatState | None = Field(
         None,
         description="Estado de la conversación (teléfono, monto, confirmación pendiente, etc.)",
     )
 
-    class Config:
-        json_schema_extra: ClassVar[dict] = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "conversation_id": 1,
                 "response": "Hola, estoy aquí para ayudarte. ¿En qué puedo asistirte?",
@@ -133,4 +176,5 @@ class ChatResponse(BaseModel):
                     "transaction_id": None,
                 },
             }
-        }
+        },
+    )
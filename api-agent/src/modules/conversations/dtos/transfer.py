@@ -0,0 +1,17 @@
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class TransferResponse(BaseModel):
+    """Respuesta de una transferencia publicada por api-transactions en la cola de respuestas."""
+
+    transaction_id: str | None = Field(None, description="ID de la transacción")
+    conversation_id: int = Field(..., description="ID de la conversación")
+    status: str = Field("unknown", description="Estado de la transacción (success/failed)")
+    message: str = Field("", description="Mensaje de respuesta")
+    balance_after: float | None = Field(
+        None, description="Saldo después de la transferencia (opcional)"
+    )
+    currency: str = Field("COP", description="Moneda")
+    error_message: str | None = Field(None, description="Mensaje de error (opcional)")
+
+    model_config = ConfigDict(frozen=True)
@@ -1,27 +1,38 @@
-from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Float, Index, Integer, String, text
 from sqlalchemy.dialects.postgresql import ENUM as PG_ENUM
+from sqlalchemy.orm import relationship
 
 from src.common.entities.base import BaseEntity
 from src.common.enums.conversation_status import ConversationStatus
 
+# Valores del enum en la BD, resueltos una sola vez al importar
+_STATUS_VALUES = [status.value for status in ConversationStatus]
+
+# Tipo nativo de PostgreSQL (ya existe en la BD) con valores explícitos; una sola instancia
+# a nivel de módulo, así sus procesadores de bind/result se crean y cachean una vez
+CONVERSATION_STATUS_TYPE = PG_ENUM(
+    ConversationStatus,
+    name="conversationstatus",
+    create_type=False,
+    values_callable=lambda _: _STATUS_VALUES,
+)
+
 
 class ConversationEntity(BaseEntity):
     __tablename__ = "conversations"
+    # Índices parciales: las consultas siempre filtran deleted_at IS NULL
+    __table_args__ = (
+        Index("ix_conversations_active", "id", postgresql_where=text("deleted_at IS NULL")),
+        Index(
+            "ix_conversations_user_active", "user_id", postgresql_where=text("deleted_at IS NULL")
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String(255), nullable=False)
     started_at = Column(DateTime(timezone=True), nullable=False)
     ended_at = Column(DateTime(timezone=True), nullable=True)
-    # Usar el enum de PostgreSQL con valores explícitos
-    status = Column(
-        PG_ENUM(
-            ConversationStatus,
-            name="conversationstatus",
-            create_type=False,
-            values_callable=lambda x: [e.value for e in x],
-        ),
-        nullable=False,
-    )
+    status = Column(CONVERSATION_STATUS_TYPE, nullable=False)
     # Campos para guardar el estado de la conversación
     # Estos campos pueden no existir en la tabla si la migración no se ha ejecutado
     # Por eso no tienen valores por defecto a nivel de Python
@@ -31,6 +42,15 @@ class ConversationEntity(BaseEntity):
     confirmation_pending = Column(Boolean, nullable=True)  # Sin default para evitar que SQLAlchemy lo inserte si no existe
     transaction_id = Column(String(255), nullable=True)
 
+    # Solo se carga de forma explícita (selectinload): un acceso perezoso lanza error
+    # en lugar de disparar un SELECT por conversación (N+1)
+    messages = relationship(
+        "MessageEntity",
+        back_populates="conversation",
+        lazy="raise",
+        order_by="MessageEntity.id",
+    )
+
     def __repr__(self):
         return (
             f"<Conversation(id={self.id}, user_id='{self.user_id}', status='{self.status.value}')>"
@@ -1,19 +1,39 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Text
+import reprlib
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, Text, text
+from sqlalchemy.orm import relationship
 
 from src.common.entities.base import BaseEntity
 
+# Vista previa acotada del contenido en el repr (también tolera content=None)
+_content_repr = reprlib.Repr()
+_content_repr.maxstring = 50
+
 
 class MessageEntity(BaseEntity):
     __tablename__ = "messages"
+    # Historial activo de una conversación en orden de creación (por id), sin visitar el
+    # heap para el role
+    __table_args__ = (
+        Index(
+            "ix_messages_conv_id",
+            "conversation_id",
+            "id",
+            postgresql_include=["role"],
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False, index=True)
     role = Column(String(20), nullable=False)  # 'user' o 'assistant'
     content = Column(Text, nullable=False)
 
+    conversation = relationship("ConversationEntity", back_populates="messages", lazy="raise")
+
     def __repr__(self):
         return (
             f"<Message(id={self.id}, conversation_id={self.conversation_id}, "
-            f"role='{self.role}', content='{self.content[:50]}...')>"
+            f"role='{self.role}', content={_content_repr.repr(self.content)})>"
         )
 
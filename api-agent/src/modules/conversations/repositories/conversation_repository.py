@@ -1,108 +1,186 @@
 import logging
+import threading
+from collections.abc import Callable
 from datetime import UTC, datetime
-from typing import Any
+from operator import attrgetter
+from typing import Any, NamedTuple
 
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import selectinload
 
 from src.common.enums.conversation_status import ConversationStatus
 from src.common.repositories import BaseRepository
 from src.common.resilience import retry_db_operation
 from src.modules.conversations.dtos.conversation import ConversationCreate, ConversationUpdate
-from src.modules.conversations.entities import Conversation
+from src.modules.conversations.entities import Conversation, Message
 
 logger = logging.getLogger(__name__)
 
+# Conversión del status a su valor en la BD según el tipo recibido (una sola búsqueda)
+_STATUS_COERCE: dict[type, Callable[[Any], str]] = {
+    ConversationStatus: attrgetter("value"),
+    str: str.lower,
+}
+
+
+# Campos de estado que pueden no existir si la migración no se ha ejecutado
+_STATE_FIELDS = frozenset(
+    {'recipient_phone', 'amount', 'currency', 'confirmation_pending', 'transaction_id'}
+)
+# Columnas básicas, presentes en cualquier versión del esquema
+_BASIC_COLUMNS = (
+    'id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at'
+)
+
+
+class _SchemaProfile(NamedTuple):
+    """Lo que cada consulta necesita saber del esquema, calculado una vez por engine."""
+
+    existing_columns: frozenset[str]
+    missing_state: frozenset[str]
+    select_columns: tuple[str, ...]
+    select_by_id: sa.TextClause
+
+
+def _build_schema_profile(existing_columns: frozenset[str]) -> _SchemaProfile:
+    select_columns = tuple(col for col in _BASIC_COLUMNS if col in existing_columns)
+    columns_str = ', '.join(f'conversations.{col}' for col in select_columns)
+    # Un único TextClause reutilizado en cada llamada: su compilación queda en la caché
+    # de SQLAlchemy en lugar de recompilarse con cada texto nuevo
+    select_by_id = sa.text(
+        f"""
+        SELECT {columns_str}
+        FROM conversations
+        WHERE conversations.id = :conversation_id
+        AND conversations.deleted_at IS NULL
+        LIMIT 1
+        """
+    ).bindparams(sa.bindparam('conversation_id', type_=sa.Integer))
+    return _SchemaProfile(
+        existing_columns, _STATE_FIELDS - existing_columns, select_columns, select_by_id
+    )
+
+
+# Columnas mapeadas de la entidad, para hidratar filas de SQL raw
+_SETTABLE = frozenset(c.key for c in Conversation.__table__.columns)
+
+
+def _hydrate(row_mapping) -> Conversation:
+    """
+    Crea una entidad Conversation (fuera de la sesión) a partir de una fila con solo las
+    columnas existentes. Los valores se copian directo al __dict__, sin pasar por los
+    descriptores instrumentados atributo por atributo.
+    """
+    db_conversation = Conversation()
+    db_conversation.__dict__.update(
+        {key: value for key, value in row_mapping.items() if key in _SETTABLE}
+    )
+    return db_conversation
+
+
+# Perfil del esquema por engine: (id(bind), tabla) -> perfil
+_SCHEMA_CACHE: dict[tuple[int, str], _SchemaProfile] = {}
+_SCHEMA_CACHE_LOCK = threading.Lock()
+
+# Campos del DTO de creación, resueltos una sola vez
+_CREATE_FIELDS = tuple(ConversationCreate.model_fields)
+
+
+def _coerce_status(data: dict[str, Any]) -> None:
+    """Normaliza en el lugar el status del dict (enum o string) al valor guardado en la BD."""
+    status = data.get("status")
+    if status is not None:
+        coerce = _STATUS_COERCE.get(status.__class__)
+        if coerce is not None:
+            data["status"] = coerce(status)
+
 
 class ConversationRepository(BaseRepository[Conversation]):
+    """
+    Repositorio de conversaciones.
+
+    create_many y las escrituras masivas dependen de la configuración del engine
+    (get_engine): insertmanyvalues para los INSERT con RETURNING y execute_batch
+    (executemany_mode="values_plus_batch") para los executemany de UPDATE.
+    """
+
     model = Conversation
 
     @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def get_by_id(self, conversation_id: int) -> Conversation | None:
-        # Verificar si hay campos de estado que no existen
-        existing_columns = self._get_existing_columns()
-        state_fields = {'recipient_phone', 'amount', 'currency', 'confirmation_pending', 'transaction_id'}
-        missing_state_fields = [field for field in state_fields if field not in existing_columns]
-        
-        # Si hay campos que no existen, usar SQL raw
-        if missing_state_fields:
-            logger.debug(f"Usando SQL raw para get_by_id porque faltan campos: {missing_state_fields}")
-            table = Conversation.__table__
-            # Construir SELECT con solo campos que existen
-            basic_columns = ['id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at']
-            columns_to_select = [col for col in basic_columns if col in existing_columns]
-            columns_str = ', '.join([f'{table.name}.{col}' for col in columns_to_select])
-            
-            sql_select = f"""
-                SELECT {columns_str}
-                FROM {table.name}
-                WHERE {table.name}.id = :conversation_id 
-                AND {table.name}.deleted_at IS NULL
-                LIMIT 1
-            """
-            
-            try:
-                result = self.session.execute(sa.text(sql_select), {'conversation_id': conversation_id})
-                row_data = result.fetchone()
-                
-                if row_data:
-                    # Crear un objeto Conversation manualmente con los datos
-                    data_dict = dict(zip(columns_to_select, row_data))
-                    db_conversation = Conversation()
-                    for key, value in data_dict.items():
-                        if hasattr(Conversation, key):
-                            setattr(db_conversation, key, value)
-                    return db_conversation
-                else:
-                    return None
-            except ProgrammingError as e:
-                logger.warning(f"Error en get_by_id con SQL raw: {str(e)}")
-                return None
-        else:
-            # Si todos los campos existen, usar el query normal
-            try:
-                return (
-                    self.session.query(Conversation)
-                    .filter(Conversation.id == conversation_id)
-                    .filter(Conversation.deleted_at.is_(None))
-                    .first()
+        # El camino (ORM o SQL raw) lo decide el perfil del esquema, no un intento fallido:
+        # en estado estable no hay consultas que fallen ni ROLLBACKs
+        profile = self._schema_profile(self.session.bind)
+        try:
+            if profile.missing_state:
+                return self._select_by_id_raw(profile, conversation_id)
+
+            # lambda_stmt: la sentencia se construye y compila una vez; las siguientes
+            # llamadas solo enlazan el id
+            stmt = sa.lambda_stmt(
+                lambda: sa.select(Conversation).where(
+                    Conversation.id == conversation_id, Conversation.deleted_at.is_(None)
                 )
-            except ProgrammingError as e:
-                # Si falla, intentar con SQL raw como fallback
-                if "column" in str(e).lower() or "does not exist" in str(e).lower():
-                    logger.debug(f"Query falló en get_by_id, usando SQL raw como fallback: {str(e)}")
-                    try:
-                        self.session.rollback()
-                    except Exception:
-                        pass
-                    
-                    table = Conversation.__table__
-                    basic_columns = ['id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at']
-                    columns_to_select = [col for col in basic_columns if col in existing_columns]
-                    columns_str = ', '.join([f'{table.name}.{col}' for col in columns_to_select])
-                    
-                    sql_select = f"""
-                        SELECT {columns_str}
-                        FROM {table.name}
-                        WHERE {table.name}.id = :conversation_id 
-                        AND {table.name}.deleted_at IS NULL
-                        LIMIT 1
-                    """
-                    
-                    result = self.session.execute(sa.text(sql_select), {'conversation_id': conversation_id})
-                    row_data = result.fetchone()
-                    
-                    if row_data:
-                        data_dict = dict(zip(columns_to_select, row_data))
-                        db_conversation = Conversation()
-                        for key, value in data_dict.items():
-                            if hasattr(Conversation, key):
-                                setattr(db_conversation, key, value)
-                        return db_conversation
-                    else:
-                        return None
-                else:
-                    raise
+            )
+            return self.session.scalars(stmt).first()
+        except ProgrammingError:
+            # El esquema cambió desde que se cacheó el perfil: se vuelve a inspeccionar
+            # en la próxima llamada
+            logger.warning("El esquema de conversations no coincide con el perfil cacheado")
+            self.invalidate_schema_cache()
+            raise
+
+    def _select_by_id_raw(
+        self, profile: _SchemaProfile, conversation_id: int
+    ) -> Conversation | None:
+        """SELECT por id solo de las columnas que existen, armando la entidad a mano."""
+        result = self.session.execute(profile.select_by_id, {'conversation_id': conversation_id})
+        row_data = result.fetchone()
+        if not row_data:
+            return None
+
+        # Crear un objeto Conversation manualmente con los datos
+        return _hydrate(row_data._mapping)
+
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
+    def get_many(self, conversation_ids: list[int]) -> dict[int, Conversation]:
+        """
+        Obtiene varias conversaciones activas en una sola consulta, indexadas por id.
+
+        Los ids viajan como un único parámetro array (id = ANY(:ids)): el SQL es el mismo
+        para cualquier cantidad de ids, en lugar de una lista IN distinta en cada llamada.
+        """
+        if not conversation_ids:
+            return {}
+
+        if self._schema_profile(self.session.bind).missing_state:
+            # Esquema sin migrar: get_by_id ya sabe armar la entidad con las columnas existentes
+            conversations = (self.get_by_id(conversation_id) for conversation_id in conversation_ids)
+            return {c.id: c for c in conversations if c is not None}
+
+        stmt = sa.lambda_stmt(
+            lambda: sa.select(Conversation).where(
+                Conversation.id == sa.any_(sa.bindparam("ids", type_=ARRAY(sa.Integer))),
+                Conversation.deleted_at.is_(None),
+            )
+        )
+        rows = self.session.scalars(stmt, {"ids": list(conversation_ids)})
+        return {conversation.id: conversation for conversation in rows}
+
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
+    def get_with_messages(self, conversation_id: int) -> Conversation | None:
+        """
+        Obtiene una conversación activa con sus mensajes activos ya cargados:
+        una consulta para la conversación y una sola más (IN) para todos sus mensajes.
+        """
+        stmt = (
+            sa.select(Conversation)
+            .options(selectinload(Conversation.messages.and_(Message.deleted_at.is_(None))))
+            .where(Conversation.id == conversation_id, Conversation.deleted_at.is_(None))
+        )
+        return self.session.scalars(stmt).first()
 
     def get_all(
         self,
@@ -110,385 +188,186 @@ class ConversationRepository(BaseRepository[Conversation]):
         limit: int = 100,
         filters: dict[str, Any] | None = None,
     ) -> list[Conversation]:
-        # El filtrado por deleted_at se hace automáticamente en _build_query del BaseRepository
+        # El filtrado por deleted_at se hace automáticamente en _build_select del BaseRepository
         return super().get_all(skip=skip, limit=limit, filters=filters)
 
-    def _get_existing_columns(self) -> set[str]:
+    def _get_existing_columns(self) -> frozenset[str]:
         """Obtiene las columnas que existen en la tabla conversations."""
-        try:
-            inspector = sa.inspect(self.session.bind)
-            columns = inspector.get_columns('conversations')
-            return {col['name'] for col in columns}
-        except Exception as e:
-            logger.warning(f"Error al obtener columnas de la tabla: {str(e)}")
-            # Retornar columnas básicas si hay error
-            return {'id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at'}
+        return self._schema_profile(self.session.bind).existing_columns
+
+    @classmethod
+    def _schema_profile(cls, bind) -> _SchemaProfile:
+        """
+        Perfil del esquema de conversations para el engine dado.
+
+        El esquema no cambia durante la vida del proceso: se inspecciona una vez por engine
+        y se reutiliza (invalidate_schema_cache lo fuerza tras aplicar migraciones).
+        """
+        cache_key = (id(bind), 'conversations')
+        profile = _SCHEMA_CACHE.get(cache_key)
+        if profile is not None:
+            return profile
+
+        with _SCHEMA_CACHE_LOCK:
+            profile = _SCHEMA_CACHE.get(cache_key)
+            if profile is not None:
+                return profile
+            try:
+                inspector = sa.inspect(bind)
+                columns = frozenset(col['name'] for col in inspector.get_columns('conversations'))
+            except Exception as e:
+                logger.warning("Error al obtener columnas de la tabla: %s", e)
+                # Usar columnas básicas si hay error (sin cachear: se reintenta luego)
+                return _build_schema_profile(frozenset(_BASIC_COLUMNS))
+            profile = _SCHEMA_CACHE[cache_key] = _build_schema_profile(columns)
+            return profile
+
+    @staticmethod
+    def invalidate_schema_cache() -> None:
+        """Descarta el esquema cacheado (p. ej. después de ejecutar migraciones)."""
+        with _SCHEMA_CACHE_LOCK:
+            _SCHEMA_CACHE.clear()
 
     def create(self, conversation_data: ConversationCreate) -> Conversation:
-        # Convertir el enum a su valor antes de crear la entidad
-        # Usar model_dump con mode='python' para obtener valores nativos
-        data = conversation_data.model_dump(mode="python", exclude_unset=True)
+        return self.create_many([conversation_data])[0]
 
-        # Establecer started_at si no se proporciona
-        if "started_at" not in data:
-            data["started_at"] = datetime.now(UTC)
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
+    def create_many(self, items: list[ConversationCreate]) -> list[Conversation]:
+        """
+        Crea varias conversaciones con un único INSERT ... RETURNING.
 
-        # Asegurar que el status sea el valor del enum (string)
-        if "status" in data:
-            if isinstance(data["status"], ConversationStatus):
-                data["status"] = data["status"].value
-            elif isinstance(data["status"], str):
-                # Si ya es string, verificar que sea válido
-                data["status"] = data["status"].lower()
+        SQLAlchemy agrupa las filas en sentencias multi-VALUES (insertmanyvalues), así que
+        N conversaciones cuestan un round-trip por página en lugar de uno por fila.
+        """
+        if not items:
+            return []
 
         # Filtrar campos que no existen en la tabla
-        existing_columns = self._get_existing_columns()
-        # Campos de estado que pueden no existir
-        state_fields = {'recipient_phone', 'amount', 'currency', 'confirmation_pending', 'transaction_id'}
-        
-        # Separar campos básicos de campos de estado
-        # Solo incluir campos básicos que existen
-        basic_data = {k: v for k, v in data.items() if k not in state_fields and k in existing_columns}
-        # Solo incluir campos de estado que existen
-        state_data = {k: v for k, v in data.items() if k in state_fields and k in existing_columns}
-        
-        # Establecer valores por defecto solo si los campos existen
-        if 'currency' in existing_columns and 'currency' not in state_data:
-            state_data['currency'] = 'COP'
-        if 'confirmation_pending' in existing_columns and 'confirmation_pending' not in state_data:
-            state_data['confirmation_pending'] = False
-        
-        # Combinar solo los campos que existen
-        final_data = {**basic_data, **state_data}
-        
+        profile = self._schema_profile(self.session.bind)
+        existing_columns = profile.existing_columns
+        rows = [self._build_insert_values(item, existing_columns) for item in items]
+
         # Log para debugging
         logger.debug(
-            f"Creando conversación - Campos existentes: {existing_columns}, "
-            f"Campos a insertar: {list(final_data.keys())}"
+            "Creando %s conversación(es) - Campos existentes: %s, Campos a insertar: %s",
+            len(rows),
+            existing_columns,
+            rows[0].keys(),
         )
 
-        try:
-            # Usar INSERT explícito con SQL raw para solo incluir campos que existen
-            # Esto evita que SQLAlchemy intente insertar campos que no existen en la tabla
-            table = Conversation.__table__
-            
-            # Filtrar valores para solo incluir campos que existen en la tabla
-            values_to_insert = {
-                col_name: final_data[col_name] 
-                for col_name in final_data.keys() 
-                if col_name in existing_columns
-            }
-            
-            # Construir el INSERT usando SQL raw para tener control total
-            if not values_to_insert:
-                raise ValueError("No hay campos válidos para insertar")
-            
-            columns = ', '.join(values_to_insert.keys())
-            placeholders = ', '.join([f':{key}' for key in values_to_insert.keys()])
-            
-            sql = f"""
-                INSERT INTO {table.name} ({columns})
-                VALUES ({placeholders})
-                RETURNING id, created_at
-            """
-            
-            # Ejecutar el INSERT
-            result = self.session.execute(sa.text(sql), values_to_insert)
-            row = result.fetchone()
-            
-            # Obtener la entidad creada usando solo campos que existen
-            conversation_id = row.id
-            
-            # Verificar si hay campos de estado que no existen
-            state_fields = {'recipient_phone', 'amount', 'currency', 'confirmation_pending', 'transaction_id'}
-            missing_state_fields = [field for field in state_fields if field not in existing_columns]
-            
-            # Si hay campos que no existen, usar SQL raw desde el principio
-            if missing_state_fields:
-                logger.debug(f"Usando SQL raw para obtener conversación porque faltan campos: {missing_state_fields}")
-                # Construir SELECT con solo campos que existen
-                basic_columns = ['id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at']
-                columns_to_select = [col for col in basic_columns if col in existing_columns]
-                columns_str = ', '.join([f'{table.name}.{col}' for col in columns_to_select])
-                
-                sql_select = f"""
-                    SELECT {columns_str}
-                    FROM {table.name}
-                    WHERE {table.name}.id = :conversation_id
-                    LIMIT 1
-                """
-                
-                result = self.session.execute(sa.text(sql_select), {'conversation_id': conversation_id})
-                row_data = result.fetchone()
-                
-                if row_data:
-                    # Crear un objeto Conversation manualmente con los datos
-                    data_dict = dict(zip(columns_to_select, row_data))
-                    db_conversation = Conversation()
-                    for key, value in data_dict.items():
-                        if hasattr(Conversation, key):
-                            setattr(db_conversation, key, value)
-                    
-                    # No agregar el objeto a la sesión porque merge() intentaría hacer un SELECT
-                    # que incluiría campos que no existen. Simplemente retornar el objeto.
-                    # El objeto ya existe en la BD, así que no necesitamos agregarlo a la sesión.
-                    return db_conversation
-                else:
-                    return None
-            else:
-                # Si todos los campos existen, usar el query normal
-                try:
-                    db_conversation = (
-                        self.session.query(Conversation)
-                        .filter(Conversation.id == conversation_id)
-                        .first()
-                    )
-                    self.session.flush()
-                    return db_conversation
-                except ProgrammingError as query_error:
-                    # Si el query falla porque hay campos que no existen, usar SQL raw
-                    if "column" in str(query_error).lower() or "does not exist" in str(query_error).lower():
-                        logger.debug(f"Query falló por campos inexistentes, usando SQL raw: {str(query_error)}")
-                        # Hacer rollback del error
-                        try:
-                            self.session.rollback()
-                        except Exception:
-                            pass
-                        
-                        # Construir SELECT con solo campos que existen
-                        basic_columns = ['id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at']
-                        columns_to_select = [col for col in basic_columns if col in existing_columns]
-                        columns_str = ', '.join([f'{table.name}.{col}' for col in columns_to_select])
-                        
-                        sql_select = f"""
-                            SELECT {columns_str}
-                            FROM {table.name}
-                            WHERE {table.name}.id = :conversation_id
-                            LIMIT 1
-                        """
-                        
-                        result = self.session.execute(sa.text(sql_select), {'conversation_id': conversation_id})
-                        row_data = result.fetchone()
-                        
-                        if row_data:
-                            # Crear un objeto Conversation manualmente con los datos
-                            # Mapear los datos a la entidad
-                            data_dict = dict(zip(columns_to_select, row_data))
-                            # Crear el objeto solo con los campos que existen
-                            # No establecer campos que no existen para evitar errores
-                            db_conversation = Conversation()
-                            for key, value in data_dict.items():
-                                if hasattr(Conversation, key):
-                                    setattr(db_conversation, key, value)
-                            
-                            # No agregar el objeto a la sesión porque merge() intentaría hacer un SELECT
-                            # que incluiría campos que no existen. Simplemente retornar el objeto.
-                            return db_conversation
-                        else:
-                            return None
-                    else:
-                        raise
-        except (ProgrammingError, Exception) as e:
-            error_str = str(e).lower()
-            error_type = type(e).__name__
-            
-            # Si falla porque los campos no existen, hacer rollback y reintentar
-            if "column" in error_str or "does not exist" in error_str or "PendingRollbackError" in error_type:
-                logger.warning(
-                    f"Algunos campos no existen en la tabla. "
-                    f"Por favor ejecuta la migración: alembic upgrade head. "
-                    f"Intentando sin campos de estado. Error: {str(e)}"
-                )
-                # Hacer rollback de la transacción fallida
-                try:
-                    self.session.rollback()
-                except Exception as rollback_error:
-                    logger.debug(f"Error en rollback (puede ser normal): {str(rollback_error)}")
-                
-                # Remover campos de estado y reintentar solo con campos básicos
-                # Asegurarse de que basic_data solo tenga campos que existen
-                safe_basic_data = {k: v for k, v in basic_data.items() if k in existing_columns}
-                
-                # Usar INSERT explícito también para el reintento
-                table = Conversation.__table__
-                # Filtrar valores para solo incluir campos que existen en la tabla
-                values_to_insert = {
-                    col_name: safe_basic_data[col_name] 
-                    for col_name in safe_basic_data.keys() 
-                    if col_name in existing_columns
-                }
-                
-                # Construir el INSERT usando SQL raw
-                if not values_to_insert:
-                    raise ValueError("No hay campos válidos para insertar")
-                
-                columns = ', '.join(values_to_insert.keys())
-                placeholders = ', '.join([f':{key}' for key in values_to_insert.keys()])
-                
-                sql = f"""
-                    INSERT INTO {table.name} ({columns})
-                    VALUES ({placeholders})
-                    RETURNING id, created_at
-                """
-                
-                result = self.session.execute(sa.text(sql), values_to_insert)
-                row = result.fetchone()
-                
-                conversation_id = row.id
-                
-                # Verificar si hay campos de estado que no existen
-                state_fields = {'recipient_phone', 'amount', 'currency', 'confirmation_pending', 'transaction_id'}
-                missing_state_fields = [field for field in state_fields if field not in existing_columns]
-                
-                # Si hay campos que no existen, usar SQL raw desde el principio
-                if missing_state_fields:
-                    logger.debug(f"Usando SQL raw para obtener conversación (reintento) porque faltan campos: {missing_state_fields}")
-                    # Construir SELECT con solo campos que existen
-                    basic_columns = ['id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at']
-                    columns_to_select = [col for col in basic_columns if col in existing_columns]
-                    columns_str = ', '.join([f'{table.name}.{col}' for col in columns_to_select])
-                    
-                    sql_select = f"""
-                        SELECT {columns_str}
-                        FROM {table.name}
-                        WHERE {table.name}.id = :conversation_id
-                        LIMIT 1
-                    """
-                    
-                    result = self.session.execute(sa.text(sql_select), {'conversation_id': conversation_id})
-                    row_data = result.fetchone()
-                    
-                    if row_data:
-                        # Crear un objeto Conversation manualmente con los datos
-                        data_dict = dict(zip(columns_to_select, row_data))
-                        db_conversation = Conversation()
-                        for key, value in data_dict.items():
-                            if hasattr(Conversation, key):
-                                setattr(db_conversation, key, value)
-                        
-                        # No agregar el objeto a la sesión porque merge() intentaría hacer un SELECT
-                        # que incluiría campos que no existen. Simplemente retornar el objeto.
-                        return db_conversation
-                    else:
-                        return None
-                else:
-                    # Si todos los campos existen, usar el query normal
-                    try:
-                        db_conversation = (
-                            self.session.query(Conversation)
-                            .filter(Conversation.id == conversation_id)
-                            .first()
-                        )
-                        self.session.flush()
-                        return db_conversation
-                    except ProgrammingError as query_error:
-                        # Si el query falla porque hay campos que no existen, usar SQL raw
-                        if "column" in str(query_error).lower() or "does not exist" in str(query_error).lower():
-                            logger.debug(f"Query falló por campos inexistentes, usando SQL raw: {str(query_error)}")
-                            # Hacer rollback del error
-                            try:
-                                self.session.rollback()
-                            except Exception:
-                                pass
-                            
-                            # Construir SELECT con solo campos que existen
-                            basic_columns = ['id', 'user_id', 'started_at', 'ended_at', 'status', 'created_at', 'updated_at', 'deleted_at']
-                            columns_to_select = [col for col in basic_columns if col in existing_columns]
-                            columns_str = ', '.join([f'{table.name}.{col}' for col in columns_to_select])
-                            
-                            sql_select = f"""
-                                SELECT {columns_str}
-                                FROM {table.name}
-                                WHERE {table.name}.id = :conversation_id
-                                LIMIT 1
-                            """
-                            
-                            result = self.session.execute(sa.text(sql_select), {'conversation_id': conversation_id})
-                            row_data = result.fetchone()
-                            
-                            if row_data:
-                                # Crear un objeto Conversation manualmente con los datos
-                                data_dict = dict(zip(columns_to_select, row_data))
-                                # Crear el objeto solo con los campos que existen
-                                db_conversation = Conversation()
-                                for key, value in data_dict.items():
-                                    if hasattr(Conversation, key):
-                                        setattr(db_conversation, key, value)
-                                
-                                # No agregar el objeto a la sesión porque merge() intentaría hacer un SELECT
-                                # que incluiría campos que no existen. Simplemente retornar el objeto.
-                                return db_conversation
-                            else:
-                                return None
-                        else:
-                            raise
-            
-            # Para otros errores, hacer rollback si es necesario
-            if "PendingRollbackError" not in error_type:
-                try:
-                    self.session.rollback()
-                except Exception:
-                    pass
-            raise
+        if not profile.missing_state:
+            # Esquema completo: INSERT ORM con RETURNING, las entidades quedan en la sesión
+            return list(self.session.scalars(sa.insert(Conversation).returning(Conversation), rows))
+
+        # Faltan campos de estado: RETURNING solo de las columnas que existen y las entidades
+        # se arman a mano, sin agregarlas a la sesión (un SELECT incluiría campos inexistentes)
+        table = Conversation.__table__
+        returning = [table.c[col] for col in profile.select_columns]
+        result = self.session.execute(sa.insert(table).returning(*returning), rows)
+
+        return [_hydrate(row._mapping) for row in result]
+
+    def _build_insert_values(
+        self, conversation_data: ConversationCreate, existing_columns: frozenset[str]
+    ) -> dict[str, Any]:
+        """Valores a insertar para una conversación: solo campos que existen en la tabla."""
+        # El DTO ya está validado: se leen sus campos directamente, sin la maquinaria de
+        # model_dump. Todos los campos (no solo los enviados) para que todas las filas
+        # tengan las mismas columnas
+        data = {name: getattr(conversation_data, name) for name in _CREATE_FIELDS}
+
+        # Establecer started_at si no se proporciona
+        data.setdefault("started_at", datetime.now(UTC))
+
+        # Asegurar que el status sea el valor del enum (string)
+        _coerce_status(data)
+
+        values = {k: v for k, v in data.items() if k in existing_columns}
+
+        # Establecer valores por defecto solo si los campos existen
+        if 'currency' in existing_columns and 'currency' not in values:
+            values['currency'] = 'COP'
+        if 'confirmation_pending' in existing_columns and 'confirmation_pending' not in values:
+            values['confirmation_pending'] = False
 
+        if not values:
+            raise ValueError("No hay campos válidos para insertar")
+        return values
+
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def update(
         self, conversation_id: int, conversation_data: ConversationUpdate
     ) -> Conversation | None:
-        db_conversation = self.get_by_id(conversation_id)
-        if not db_conversation:
-            return None
+        """
+        Actualiza una conversación activa con un único UPDATE ... RETURNING.
+        Retorna None si no existe (o está eliminada), sin un SELECT previo.
+        """
+        profile = self._schema_profile(self.session.bind)
+        filtered_update = self._build_update_values(conversation_data, profile.missing_state)
+        if not filtered_update:
+            return self.get_by_id(conversation_id)
+
+        if not profile.missing_state:
+            # Esquema completo: la entidad actualizada vuelve en el RETURNING y queda en la sesión
+            stmt = (
+                sa.update(Conversation)
+                .where(Conversation.id == conversation_id, Conversation.deleted_at.is_(None))
+                .values(**filtered_update)
+                .returning(Conversation)
+            )
+            return self.session.scalars(stmt).one_or_none()
 
+        # Faltan campos de estado: RETURNING solo de las columnas que existen
+        table = Conversation.__table__
+        stmt = (
+            sa.update(table)
+            .where(table.c.id == conversation_id, table.c.deleted_at.is_(None))
+            .values(**filtered_update)
+            .returning(*[table.c[col] for col in profile.select_columns])
+        )
+        row = self.session.execute(stmt).first()
+        return _hydrate(row._mapping) if row is not None else None
+
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
+    def update_fields(self, conversation_id: int, conversation_data: ConversationUpdate) -> bool:
+        """
+        Actualiza una conversación activa sin devolverla: para quien solo necesita saber
+        si existía. No hay SELECT previo ni filas que parsear; basta el rowcount del UPDATE.
+        """
+        filtered_update = self._build_update_values(
+            conversation_data, self._schema_profile(self.session.bind).missing_state
+        )
+        if not filtered_update:
+            return self.get_by_id(conversation_id) is not None
+
+        stmt = (
+            sa.update(Conversation)
+            .where(Conversation.id == conversation_id, Conversation.deleted_at.is_(None))
+            .values(**filtered_update)
+        )
+        return self.session.execute(stmt).rowcount > 0
+
+    def _build_update_values(
+        self, conversation_data: ConversationUpdate, missing_state: frozenset[str]
+    ) -> dict[str, Any]:
+        """Campos enviados en la actualización que existen en la tabla."""
+        # Pydantic descarta los campos sin columna en el mismo volcado, sin filtrar después
+        update_data = conversation_data.model_dump(
+            exclude_unset=True, exclude=set(missing_state) or None, mode="python"
+        )
         # Convertir el enum a su valor antes de actualizar
-        update_data = conversation_data.model_dump(exclude_unset=True, mode="python")
-        if "status" in update_data:
-            if isinstance(update_data["status"], ConversationStatus):
-                update_data["status"] = update_data["status"].value
-            elif isinstance(update_data["status"], str):
-                update_data["status"] = update_data["status"].lower()
-        
-        # Filtrar campos que no existen en la tabla
-        existing_columns = self._get_existing_columns()
-        # Campos de estado que pueden no existir
-        state_fields = {'recipient_phone', 'amount', 'currency', 'confirmation_pending', 'transaction_id'}
-        
-        # Separar campos básicos de campos de estado
-        basic_update = {k: v for k, v in update_data.items() if k not in state_fields}
-        state_update = {k: v for k, v in update_data.items() if k in state_fields and k in existing_columns}
-        
-        # Combinar solo los campos que existen
-        filtered_update = {**basic_update, **state_update}
-        
-        try:
-            return super().update(db_conversation, filtered_update)
-        except ProgrammingError as e:
-            # Si falla porque los campos no existen, hacer rollback y reintentar
-            if "column" in str(e).lower() or "does not exist" in str(e).lower():
-                logger.warning(
-                    f"Algunos campos no existen en la tabla. "
-                    f"Por favor ejecuta la migración: alembic upgrade head. "
-                    f"Intentando sin campos de estado. Error: {str(e)}"
-                )
-                # Hacer rollback de la transacción fallida
-                self.session.rollback()
-                # Remover campos de estado y reintentar solo con campos básicos
-                return super().update(db_conversation, basic_update)
-            raise
-        except Exception as e:
-            # Para cualquier otro error, hacer rollback
-            if "rollback" not in str(e).lower():
-                self.session.rollback()
-            raise
+        _coerce_status(update_data)
+        return update_data
 
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def delete(self, conversation_id: int) -> bool:
         """
-        Elimina una conversación (soft delete).
-        El listener de SQLAlchemy interceptará el DELETE y establecerá deleted_at automáticamente.
+        Elimina una conversación (soft delete) con un único UPDATE de deleted_at,
+        sin cargar la entidad ni pasar por el listener de session.delete.
         """
-        db_conversation = self.get_by_id(conversation_id)
-        if not db_conversation:
-            return False
-
-        # El listener de SQLAlchemy manejará el soft delete automáticamente
-        # Solo necesitamos llamar a session.delete y el listener convertirá en UPDATE
-        super().delete(db_conversation)
-        return True
+        stmt = (
+            sa.update(Conversation)
+            .where(Conversation.id == conversation_id, Conversation.deleted_at.is_(None))
+            .values(deleted_at=datetime.now(UTC))
+        )
+        return self.session.execute(stmt).rowcount > 0
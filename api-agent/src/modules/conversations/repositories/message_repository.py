@@ -1,5 +1,11 @@
+import csv
+import io
+from collections.abc import Iterable
 from typing import Any
 
+import sqlalchemy as sa
+from sqlalchemy.orm import raiseload
+
 from src.common.repositories import BaseRepository
 from src.common.resilience import retry_db_operation
 from src.modules.conversations.entities import Message
@@ -10,18 +16,48 @@ class MessageRepository(BaseRepository[Message]):
 
     @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def get_by_conversation_id(
-        self, conversation_id: int, skip: int = 0, limit: int = 100
+        self, conversation_id: int, after_id: int | None = None, limit: int = 100
     ) -> list[Message]:
-        """Obtiene todos los mensajes de una conversación ordenados por fecha de creación."""
-        return (
-            self.session.query(Message)
-            .filter(Message.conversation_id == conversation_id)
-            .filter(Message.deleted_at.is_(None))
-            .order_by(Message.created_at.asc())
-            .offset(skip)
+        """
+        Obtiene los mensajes de una conversación en orden de creación, paginados por keyset:
+        para la página siguiente se pasa after_id con el id del último mensaje recibido.
+
+        El orden es por id (serial, igual al de creación) para que PostgreSQL busque
+        directo en ix_messages_conv_id en lugar de recorrer y descartar filas con OFFSET.
+
+        Solo se leen columnas del mensaje: no se carga ninguna relación, y raiseload
+        convierte cualquier acceso perezoso (p. ej. message.conversation) en un error
+        en lugar de un SELECT por mensaje.
+        """
+        stmt = (
+            sa.select(Message)
+            .options(raiseload("*"))
+            .where(Message.conversation_id == conversation_id, Message.deleted_at.is_(None))
+            .order_by(Message.id.asc())
+            .limit(limit)
+        )
+        if after_id is not None:
+            stmt = stmt.where(Message.id > after_id)
+        return list(self.session.scalars(stmt))
+
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
+    def get_recent_by_conversation_id(self, conversation_id: int, limit: int) -> list[Message]:
+        """
+        Obtiene los últimos `limit` mensajes de una conversación, en orden de creación.
+
+        Recorre ix_messages_conv_id hacia atrás y se detiene en `limit` filas: el costo no
+        depende del largo de la conversación.
+        """
+        stmt = (
+            sa.select(Message)
+            .options(raiseload("*"))
+            .where(Message.conversation_id == conversation_id, Message.deleted_at.is_(None))
+            .order_by(Message.id.desc())
             .limit(limit)
-            .all()
         )
+        messages = list(self.session.scalars(stmt))
+        messages.reverse()
+        return messages
 
     def create_message(
         self, conversation_id: int, role: str, content: str
@@ -35,23 +71,59 @@ class MessageRepository(BaseRepository[Message]):
         db_message = Message(**message_data)
         return super().create(db_message)
 
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
     def create_messages(
         self, conversation_id: int, messages: list[dict[str, Any]]
     ) -> list[Message]:
-        """Crea múltiples mensajes en la base de datos."""
-        db_messages = []
-        for msg in messages:
-            message_data = {
+        """
+        Crea múltiples mensajes con un único INSERT ... RETURNING.
+
+        Las filas se agrupan en sentencias multi-VALUES (insertmanyvalues) y RETURNING trae
+        id y timestamps, así que no hace falta un refresh por mensaje. No hace commit: la
+        transacción la cierra get_db al final del request.
+        """
+        if not messages:
+            return []
+
+        rows = [
+            {
                 "conversation_id": conversation_id,
                 "role": msg.get("role", "user"),
                 "content": msg.get("content", ""),
             }
-            db_message = Message(**message_data)
-            db_messages.append(db_message)
+            for msg in messages
+        ]
+        return list(self.session.scalars(sa.insert(Message).returning(Message), rows))
+
+    @retry_db_operation(max_attempts=3, initial_wait=0.5, max_wait=5.0)
+    def insert_many(self, rows: list[dict[str, Any]]) -> int:
+        """
+        Inserta mensajes de varias conversaciones con un único INSERT en lote, sin RETURNING:
+        cada fila es un dict con conversation_id, role y content. Retorna las filas insertadas.
+        """
+        if not rows:
+            return 0
+
+        self.session.execute(sa.insert(Message), rows)
+        return len(rows)
+
+    def copy_many(self, rows: Iterable[tuple[int, str, str]]) -> int:
+        """
+        Importa mensajes en bloque con COPY FROM STDIN: (conversation_id, role, content).
 
-        self.session.add_all(db_messages)
-        self.session.commit()
-        for db_message in db_messages:
-            self.session.refresh(db_message)
-        return db_messages
+        Usa la conexión de la sesión, así que queda dentro de la misma transacción
+        (un rollback también deshace la importación). Retorna las filas copiadas.
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
 
+        # Las conversaciones pendientes deben existir antes de copiar por la FK
+        self.session.flush()
+        dbapi_connection = self.session.connection().connection
+        with dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY messages (conversation_id, role, content) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+            return cursor.rowcount
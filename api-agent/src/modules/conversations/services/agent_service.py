@@ -1,49 +1,115 @@
 import logging
+from collections.abc import AsyncIterator
 from typing import Any
 
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from src.common.enums.conversation_status import ConversationStatus
 from src.common.redis_service import get_redis_service
-from src.modules.conversations.agent.transaction_agent import TransactionAgent
+from src.modules.conversations.agent.agent_state import MAX_HISTORY_MESSAGES
+from src.modules.conversations.agent.transaction_agent import get_transaction_agent
+from src.modules.conversations.entities import Conversation
 from src.modules.conversations.repositories.conversation_repository import ConversationRepository
 from src.modules.conversations.repositories.message_repository import MessageRepository
 
 logger = logging.getLogger(__name__)
 
+# Estado "vivo" de la conversación persistido en BD, con su valor por defecto
+_STATE_DEFAULTS: dict[str, Any] = {
+    "recipient_phone": None,
+    "amount": None,
+    "currency": "COP",
+    "confirmation_pending": False,
+    "transaction_id": None,
+}
+
+
+def _state_snapshot(context: dict[str, Any]) -> dict[str, Any]:
+    return {field: context.get(field, default) for field, default in _STATE_DEFAULTS.items()}
+
 
 class AgentService:
     def __init__(self, db: Session, openai_api_key: str | None = None):
-        self.agent = TransactionAgent(openai_api_key)
+        self.agent = get_transaction_agent(openai_api_key)
         self.repository = ConversationRepository(db)
         self.message_repository = MessageRepository(db)
         self.redis_service = get_redis_service()
-        self._context_cache: dict[int, dict[str, Any]] = {}  # Fallback en memoria
-
-    def get_conversation_context(self, conversation_id: int) -> dict[str, Any]:
-        redis_key = f"conversation:{conversation_id}"
-        redis_data = self.redis_service.get(redis_key)
-        
-        if conversation_id in self._context_cache:
-            cached_context = self._context_cache[conversation_id]
-            if redis_data:
-                cached_context["recipient_phone"] = redis_data.get("recipient_phone")
-                cached_context["amount"] = redis_data.get("amount")
-            return cached_context
-
-        conversation = self.repository.get_by_id(conversation_id)
-        
-        recipient_phone = None
-        amount = None
-        if redis_data:
-            recipient_phone = redis_data.get("recipient_phone")
-            amount = redis_data.get("amount")
-            logger.debug(f"Datos cargados desde Redis para conversación {conversation_id}: phone={recipient_phone}, amount={amount}")
-        
+
+    async def get_conversation_context(
+        self, conversation_id: int, conversation: Conversation | None = None
+    ) -> dict[str, Any]:
+        """
+        Carga el contexto de la conversación: primero Redis y luego BD.
+
+        El estado vive en el hash conversation_state:{id}, compartido entre workers: si
+        tiene todos los campos no se lee la conversación de BD. Si quien llama ya tiene la
+        conversación, se pasa en `conversation` y tampoco se vuelve a leer.
+        """
+        redis_key = f"conversation_state:{conversation_id}"
+        redis_data = await self.redis_service.get_hash(redis_key) or {}
+        shared_state = {
+            field: redis_data[field] for field in _STATE_DEFAULTS if field in redis_data
+        }
+
+        state_in_redis = len(shared_state) == len(_STATE_DEFAULTS)
+        # La sesión de BD es síncrona: conversación y mensajes se leen en un único salto
+        # al threadpool, sin bloquear el event loop
+        loaded, messages = await run_in_threadpool(
+            self._load_from_db, conversation_id, not state_in_redis and conversation is None
+        )
+        conversation = conversation or loaded
+
+        if state_in_redis:
+            state = shared_state
+            user_id = redis_data.get("user_id")
+            logger.debug("Estado cargado desde Redis para conversación %s", conversation_id)
+        else:
+            state = {
+                field: getattr(conversation, field, default) if conversation else default
+                for field, default in _STATE_DEFAULTS.items()
+            }
+            # Lo extraído y guardado en Redis (teléfono, monto) prevalece sobre la BD
+            state.update({field: value for field, value in shared_state.items() if value})
+            user_id = getattr(conversation, "user_id", None) if conversation else None
+
+        context = {
+            **state,
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "messages": messages,
+        }
+
+        logger.debug(
+            "Cargando contexto de conversación %s - Teléfono: %s, Monto: %s, "
+            "Confirmación pendiente: %s, Mensajes: %s",
+            conversation_id,
+            state["recipient_phone"],
+            state["amount"],
+            state["confirmation_pending"],
+            len(messages),
+        )
+
+        if not state_in_redis:
+            await self.redis_service.update_hash(
+                redis_key, {**state, "conversation_id": conversation_id, "user_id": user_id}
+            )
+
+        return context
+
+    def _load_from_db(
+        self, conversation_id: int, load_conversation: bool
+    ) -> tuple[Conversation | None, list[dict[str, str]]]:
+        """Lee (si hace falta) la conversación y los últimos mensajes, en la misma sesión."""
+        conversation = self.repository.get_by_id(conversation_id) if load_conversation else None
+
         messages = []
         try:
-            db_messages = self.message_repository.get_by_conversation_id(
-                conversation_id=conversation_id, limit=100
+            # El agente solo usa los últimos MAX_HISTORY_MESSAGES: no se carga más historial
+            db_messages = self.message_repository.get_recent_by_conversation_id(
+                conversation_id=conversation_id,
+                limit=MAX_HISTORY_MESSAGES,
             )
             messages = [
                 {"role": msg.role, "content": msg.content}
@@ -52,96 +118,104 @@ class AgentService:
         except ProgrammingError as e:
             if "does not exist" in str(e) or "relation" in str(e).lower():
                 logger.warning(
-                    f"La tabla 'messages' no existe. "
-                    f"Por favor ejecuta la migración: alembic upgrade head. "
-                    f"Error: {str(e)}"
+                    "La tabla 'messages' no existe. "
+                    "Por favor ejecuta la migración: alembic upgrade head. "
+                    "Error: %s",
+                    e,
                 )
             else:
                 raise
         except Exception as e:
-            logger.error(f"Error al cargar mensajes desde BD: {str(e)}")
-
-        if not recipient_phone:
-            recipient_phone = getattr(conversation, "recipient_phone", None) if conversation else None
-        if not amount:
-            amount = getattr(conversation, "amount", None) if conversation else None
-        
-        currency = getattr(conversation, "currency", "COP") if conversation else "COP"
-        confirmation_pending = getattr(conversation, "confirmation_pending", False) if conversation else False
-        transaction_id = getattr(conversation, "transaction_id", None) if conversation else None
-        user_id = getattr(conversation, "user_id", None) if conversation else None
-        
-        context = {
-            "recipient_phone": recipient_phone,
-            "amount": amount,
-            "currency": currency,
-            "confirmation_pending": confirmation_pending,
-            "transaction_id": transaction_id,
-            "conversation_id": conversation_id,
-            "user_id": user_id,
-            "messages": messages,
-        }
-        
-        logger.debug(
-            f"Cargando contexto de conversación {conversation_id} - "
-            f"Teléfono: {recipient_phone}, Monto: {amount}, "
-            f"Confirmación pendiente: {confirmation_pending}, "
-            f"Mensajes: {len(messages)}"
-        )
+            logger.error("Error al cargar mensajes desde BD: %s", e)
 
-        self._context_cache[conversation_id] = context
-        
-        redis_key = f"conversation:{conversation_id}"
-        redis_data = {
-            "recipient_phone": recipient_phone,
-            "amount": amount,
-            "conversation_id": conversation_id,
-            "user_id": user_id,
-        }
-        self.redis_service.set(redis_key, redis_data)
+        return conversation, messages
 
-        return context
+    async def save_conversation_context(
+        self,
+        conversation_id: int,
+        context: dict[str, Any],
+        previous_state: dict[str, Any] | None = None,
+    ):
+        """
+        Guarda el contexto en Redis y BD. Con previous_state (el estado al inicio del
+        turno) solo se escriben en BD los campos que cambiaron, y ninguno si no cambió nada.
+        Si hay transaction_id, el mismo UPDATE marca la conversación como completada.
+        """
+        # El contexto devuelto conserva solo la ventana de historial que usa el agente
+        context["messages"] = context.get("messages", [])[-MAX_HISTORY_MESSAGES:]
+
+        # Write-through del estado completo al hash compartido (con el TTL de REDIS_TTL)
+        state = _state_snapshot(context)
+        redis_key = f"conversation_state:{conversation_id}"
+        redis_data = {**state, "conversation_id": conversation_id, "user_id": context.get("user_id")}
+        await self.redis_service.update_hash(redis_key, redis_data)
+
+        completed = bool(state["transaction_id"])
+        if previous_state is not None:
+            state = {
+                field: value for field, value in state.items() if previous_state.get(field) != value
+            }
+            if not state and not completed:
+                logger.debug("Estado sin cambios para conversación %s", conversation_id)
+                return
+
+        # Con una transacción ejecutada la conversación se cierra en el mismo UPDATE
+        if completed:
+            state["status"] = ConversationStatus.COMPLETED
 
-    def save_conversation_context(self, conversation_id: int, context: dict[str, Any]):
-        self._context_cache[conversation_id] = context
-        
-        redis_key = f"conversation:{conversation_id}"
-        redis_data = {
-            "recipient_phone": context.get("recipient_phone"),
-            "amount": context.get("amount"),
-            "conversation_id": conversation_id,
-            "user_id": context.get("user_id"),
-        }
-        self.redis_service.set(redis_key, redis_data)
-        
         try:
             from src.modules.conversations.dtos.conversation import ConversationUpdate
-            
-            update_data = ConversationUpdate(
-                recipient_phone=context.get("recipient_phone"),
-                amount=context.get("amount"),
-                currency=context.get("currency", "COP"),
-                confirmation_pending=context.get("confirmation_pending", False),
-                transaction_id=context.get("transaction_id"),
-            )
-            self.repository.update(conversation_id, update_data)
-            logger.debug(f"Estado guardado en BD y Redis para conversación {conversation_id}")
+
+            # Solo los campos pasados quedan "set" en el DTO: el UPDATE no toca el resto
+            update_data = ConversationUpdate(**state)
+            await run_in_threadpool(self.repository.update_fields, conversation_id, update_data)
+            logger.debug("Estado guardado en BD y Redis para conversación %s", conversation_id)
         except Exception as e:
-            logger.error(f"Error al guardar el estado de la conversación en BD: {str(e)}")
+            logger.error("Error al guardar el estado de la conversación en BD: %s", e)
 
-    def process_message(
-        self, user_message: str, conversation_id: int, _user_id: str
+    async def process_message(
+        self,
+        user_message: str,
+        conversation_id: int,
+        _user_id: str,
+        conversation: Conversation | None = None,
     ) -> dict[str, Any]:
-        conversation_state = self.get_conversation_context(conversation_id)
+        conversation_state = await self.get_conversation_context(conversation_id, conversation)
         conversation_state["user_id"] = _user_id
         conversation_state["conversation_id"] = conversation_id
+        previous_state = _state_snapshot(conversation_state)
 
-        result = self.agent.process(user_message, conversation_state)
+        result = await self.agent.process(user_message, conversation_state)
 
-        self.save_conversation_context(conversation_id, result["state"])
+        await self.save_conversation_context(conversation_id, result["state"], previous_state)
 
         return {
             "response": result["response"],
             "conversation_id": conversation_id,
             "state": result["state"],
         }
+
+    async def stream_message(
+        self,
+        user_message: str,
+        conversation_id: int,
+        user_id: str,
+        conversation: Conversation | None = None,
+    ) -> AsyncIterator[str | dict[str, Any]]:
+        """Igual que process_message, pero emite los tokens de la respuesta a medida que llegan."""
+        conversation_state = await self.get_conversation_context(conversation_id, conversation)
+        conversation_state["user_id"] = user_id
+        conversation_state["conversation_id"] = conversation_id
+        previous_state = _state_snapshot(conversation_state)
+
+        async for chunk in self.agent.astream(user_message, conversation_state):
+            if isinstance(chunk, str):
+                yield chunk
+                continue
+
+            await self.save_conversation_context(conversation_id, chunk["state"], previous_state)
+            yield {
+                "response": chunk["response"],
+                "conversation_id": conversation_id,
+                "state": chunk["state"],
+            }
@@ -1,22 +1,34 @@
+import json
 import logging
+from collections.abc import AsyncIterator
+from typing import Any
 
+from pydantic import TypeAdapter
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from src.common.enums.conversation_status import ConversationStatus
+from src.modules.conversations.agent.agent_state import MAX_HISTORY_MESSAGES
 from src.modules.conversations.dtos.conversation import (
     ChatMessage,
     ChatResponse,
     ConversationCreate,
     ConversationResponse,
     ConversationUpdate,
+    MessageResponse,
 )
+from src.modules.conversations.entities import Conversation
 from src.modules.conversations.repositories.conversation_repository import ConversationRepository
 from src.modules.conversations.repositories.message_repository import MessageRepository
 from src.modules.conversations.services.agent_service import AgentService
 
 logger = logging.getLogger(__name__)
 
+# Valida la lista completa en una sola llamada al núcleo de Pydantic, no fila por fila
+_CONVERSATION_LIST_ADAPTER = TypeAdapter(list[ConversationResponse])
+_MESSAGE_LIST_ADAPTER = TypeAdapter(list[MessageResponse])
+
 
 class ConversationsService:
     def __init__(self, db: Session, openai_api_key: str | None = None):
@@ -32,7 +44,18 @@ class ConversationsService:
 
     def get_conversations(self, skip: int = 0, limit: int = 100) -> list[ConversationResponse]:
         conversations = self.repository.get_all(skip=skip, limit=limit)
-        return [ConversationResponse.model_validate(c) for c in conversations]
+        return _CONVERSATION_LIST_ADAPTER.validate_python(conversations, from_attributes=True)
+
+    def get_messages(
+        self, conversation_id: int, after_id: int | None = None, limit: int = 100
+    ) -> list[MessageResponse] | None:
+        """Mensajes de la conversación paginados por keyset; None si la conversación no existe."""
+        if not self.repository.get_by_id(conversation_id):
+            return None
+        messages = self.message_repository.get_by_conversation_id(
+            conversation_id, after_id=after_id, limit=limit
+        )
+        return _MESSAGE_LIST_ADAPTER.validate_python(messages, from_attributes=True)
 
     def create_conversation(self, conversation_data: ConversationCreate) -> ConversationResponse:
         conversation = self.repository.create(conversation_data)
@@ -49,7 +72,8 @@ class ConversationsService:
     def delete_conversation(self, conversation_id: int) -> bool:
         return self.repository.delete(conversation_id)
 
-    def process_chat_message(self, chat_message: ChatMessage, user_id: str) -> ChatResponse:
+    def resolve_conversation(self, chat_message: ChatMessage, user_id: str) -> Conversation:
+        """Obtiene la conversación del mensaje o crea una nueva, reactivándola si estaba cerrada."""
         conversation = None
 
         if chat_message.conversation_id:
@@ -66,17 +90,48 @@ class ConversationsService:
             update_data = ConversationUpdate(status=ConversationStatus.ACTIVE)
             conversation = self.repository.update(conversation.id, update_data)
 
-        agent_result = self.agent_service.process_message(
-            user_message=chat_message.message, conversation_id=conversation.id, _user_id=user_id
+        return conversation
+
+    async def process_chat_message(self, chat_message: ChatMessage, user_id: str) -> ChatResponse:
+        conversation = await run_in_threadpool(self.resolve_conversation, chat_message, user_id)
+
+        # La conversación ya resuelta se reutiliza: el contexto no vuelve a leerla de BD
+        agent_result = await self.agent_service.process_message(
+            user_message=chat_message.message,
+            conversation_id=conversation.id,
+            _user_id=user_id,
+            conversation=conversation,
         )
 
+        return await run_in_threadpool(self._save_turn, conversation, agent_result)
+
+    async def stream_chat_message(
+        self, conversation: Conversation, message: str, user_id: str
+    ) -> AsyncIterator[str]:
+        """
+        Emite la respuesta del agente como eventos SSE y guarda el turno al terminar.
+
+        Cada fragmento llega en un evento "token" (texto como string JSON); el último
+        evento, "done", trae el ChatResponse completo.
+        """
+        async for chunk in self.agent_service.stream_message(
+            message, conversation.id, user_id, conversation
+        ):
+            if isinstance(chunk, str):
+                yield f"event: token\ndata: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            else:
+                chat_response = await run_in_threadpool(self._save_turn, conversation, chunk)
+                yield f"event: done\ndata: {chat_response.model_dump_json()}\n\n"
+
+    def _save_turn(self, conversation: Conversation, agent_result: dict[str, Any]) -> ChatResponse:
         # Guardar mensajes en la base de datos
         messages = agent_result["state"].get("messages", [])
         if messages:
             try:
-                # Obtener los mensajes existentes en BD para comparar
-                existing_messages = self.message_repository.get_by_conversation_id(
-                    conversation_id=conversation.id, limit=100
+                # Un duplicado solo puede venir de la ventana de historial que vio el agente:
+                # basta comparar con los últimos mensajes en BD (búsqueda por índice)
+                existing_messages = self.message_repository.get_recent_by_conversation_id(
+                    conversation_id=conversation.id, limit=MAX_HISTORY_MESSAGES
                 )
                 existing_content_set = {
                     (m.role, m.content) for m in existing_messages
@@ -84,19 +139,18 @@ class ConversationsService:
                 
                 # Guardar solo los mensajes nuevos (los últimos 2: usuario y asistente)
                 new_messages = messages[-2:] if len(messages) >= 2 else messages
+                to_create = []
                 for msg in new_messages:
                     role = msg.get("role")
                     content = msg.get("content", "")
                     if role and content:
                         # Solo guardar si no existe un mensaje idéntico
                         if (role, content) not in existing_content_set:
-                            self.message_repository.create_message(
-                                conversation_id=conversation.id,
-                                role=role,
-                                content=content,
-                            )
+                            to_create.append({"role": role, "content": content})
                             # Agregar a la lista de existentes para evitar duplicados en la misma ejecución
                             existing_content_set.add((role, content))
+                # Un único INSERT para todos los mensajes nuevos del turno
+                self.message_repository.create_messages(conversation.id, to_create)
             except ProgrammingError as e:
                 # Si la tabla no existe, loguear el error pero continuar
                 if "does not exist" in str(e) or "relation" in str(e).lower():
@@ -114,8 +168,7 @@ class ConversationsService:
                 logger.error(f"Error al guardar mensajes en BD: {str(e)}")
 
         if agent_result["state"].get("transaction_id"):
-            update_data = ConversationUpdate(status=ConversationStatus.COMPLETED)
-            self.repository.update(conversation.id, update_data)
+            # El status ya se guardó con el resto del estado en save_conversation_context
             conversation_status = ConversationStatus.COMPLETED
         else:
             conversation_status = ConversationStatus(conversation.status)
@@ -1,95 +1,98 @@
+import asyncio
 import logging
-import threading
-from typing import Any
 
-from src.configuration.config import get_session
+import aio_pika
+from aio_pika.abc import AbstractIncomingMessage, AbstractRobustConnection
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from src.configuration.config import get_session, settings
+from src.modules.conversations.dtos.transfer import TransferResponse
 from src.modules.conversations.repositories.conversation_repository import ConversationRepository
 from src.modules.conversations.repositories.message_repository import MessageRepository
 
 logger = logging.getLogger(__name__)
 
+# Respuestas agrupadas por escritura en BD: se escribe al llegar a 100 o tras 50 ms
+RESPONSE_BATCH_SIZE = 100
+RESPONSE_BATCH_TIMEOUT_SECONDS = 0.05
+# Lotes escribiéndose en BD a la vez (cada uno ocupa un thread y una conexión del pool)
+RESPONSE_MAX_CONCURRENT_BATCHES = 4
+# Espera entre intentos de conexión o de preparación del canal con RabbitMQ
+CONNECT_RETRY_DELAY_SECONDS = 5
+
 
 class ResponseConsumerService:
-    """Servicio para procesar mensajes de respuesta de transferencias desde RabbitMQ"""
+    """
+    Servicio para procesar mensajes de respuesta de transferencias desde RabbitMQ.
+
+    Consume con aio-pika dentro del event loop de la aplicación (sin thread propio): los
+    mensajes se agrupan en lotes y cada lote se escribe en BD desde el threadpool, con
+    varios lotes en curso a la vez.
+    """
 
     def __init__(self):
-        self.consumer_thread = None
-        self.consumer = None
+        self.connection: AbstractRobustConnection | None = None
+        self._task: asyncio.Task | None = None
+        self._batch_tasks: set[asyncio.Task] = set()
+        self._db_slots = asyncio.Semaphore(RESPONSE_MAX_CONCURRENT_BATCHES)
 
-    def _process_message(self, message_data: dict[str, Any]):
+    def _process_batch(self, batch: list[TransferResponse]):
         """
-        Procesa un mensaje de respuesta de transferencia recibido de RabbitMQ
-
-        Args:
-            message_data: Diccionario con los datos de la respuesta:
-                - transaction_id: ID de la transacción
-                - conversation_id: ID de la conversación
-                - status: Estado de la transacción (success/failed)
-                - message: Mensaje de respuesta
-                - balance_after: Saldo después de la transferencia (opcional)
-                - currency: Moneda (opcional)
-                - error_message: Mensaje de error (opcional)
+        Procesa un lote de respuestas de transferencia con una sola sesión: una consulta
+        para todas las conversaciones, un INSERT para todos los mensajes y un commit.
+
+        Solo se omiten las respuestas de conversaciones inexistentes; cualquier otro error
+        se propaga para que el lote no se confirme en RabbitMQ.
         """
-        transaction_id = message_data.get("transaction_id", "unknown")
-        conversation_id = message_data.get("conversation_id", "unknown")
-        status = message_data.get("status", "unknown")
-        
-        logger.info(
-            f"Respuesta de transferencia recibida: transaction_id={transaction_id}, "
-            f"conversation_id={conversation_id}, status={status}"
-        )
-        
+        for response in batch:
+            logger.info(
+                "Respuesta de transferencia recibida: transaction_id=%s, conversation_id=%s, status=%s",
+                response.transaction_id,
+                response.conversation_id,
+                response.status,
+            )
+
         db = None
         try:
             db = get_session()
             conversation_repo = ConversationRepository(db)
             message_repo = MessageRepository(db)
-            
-            # Convertir conversation_id a int
-            try:
-                conversation_id_int = int(conversation_id)
-            except (ValueError, TypeError):
-                logger.error(f"conversation_id inválido: {conversation_id}")
-                return
-            
-            # Obtener la conversación
-            conversation = conversation_repo.get_by_id(conversation_id_int)
-            if not conversation:
-                logger.warning(f"Conversación {conversation_id_int} no encontrada")
-                return
-            
-            # Construir el mensaje de respuesta
-            response_message = message_data.get("message", "")
-            
-            # Si hay saldo después, agregarlo al mensaje
-            if status == "success" and message_data.get("balance_after") is not None:
-                balance_after = message_data.get("balance_after")
-                currency = message_data.get("currency", "COP")
-                response_message += f"\n\nTu saldo después de la transferencia es ${balance_after:,.0f} {currency}."
-            
-            # Guardar el mensaje en la conversación
-            try:
-                message_repo.create_message(
-                    conversation_id=conversation_id_int,
-                    role="assistant",
-                    content=response_message,
+
+            # Obtener las conversaciones del lote
+            conversations = conversation_repo.get_many(
+                list({response.conversation_id for response in batch})
+            )
+
+            rows = []
+            for response in batch:
+                if response.conversation_id not in conversations:
+                    logger.warning("Conversación %s no encontrada", response.conversation_id)
+                    continue
+                rows.append(
+                    {
+                        "conversation_id": response.conversation_id,
+                        "role": "assistant",
+                        "content": self._build_response_message(response),
+                    }
                 )
-                db.commit()
-                logger.info(f"Mensaje de respuesta guardado en conversación {conversation_id_int}")
-            except Exception as msg_error:
-                logger.error(f"Error al guardar mensaje de respuesta: {str(msg_error)}", exc_info=True)
-                db.rollback()
-            
-        except Exception as e:
+
+            # Guardar los mensajes en sus conversaciones
+            message_repo.insert_many(rows)
+            db.commit()
+            logger.info("%s mensaje(s) de respuesta guardado(s)", len(rows))
+
+        except Exception:
             logger.error(
-                f"Error al procesar respuesta de transferencia transaction_id={transaction_id}: {str(e)}",
-                exc_info=True,
+                "Error al procesar %s respuesta(s) de transferencia", len(batch), exc_info=True
             )
             if db:
                 try:
                     db.rollback()
                 except Exception:
                     pass
+            # Propagar para que el lote se rechace y RabbitMQ lo reentregue
+            raise
         finally:
             if db:
                 try:
@@ -97,35 +100,143 @@ class ResponseConsumerService:
                 except Exception:
                     pass
 
-    def _run_consumer(self):
-        """Ejecuta el consumidor en un thread separado"""
-        try:
-            from src.configuration.config import settings
-            from src.common.rabbitmq_consumer import RabbitMQConsumer
+    @staticmethod
+    def _build_response_message(response: TransferResponse) -> str:
+        """Construye el mensaje de respuesta que se guarda en la conversación."""
+        response_message = response.message
 
-            # Crear un consumidor para la cola de respuestas
-            self.consumer = RabbitMQConsumer(
-                message_handler=self._process_message,
-                queue_name=settings.RABBITMQ_RESPONSE_QUEUE,
+        # Si hay saldo después, agregarlo al mensaje
+        if response.status == "success" and response.balance_after is not None:
+            response_message += (
+                f"\n\nTu saldo después de la transferencia es "
+                f"${response.balance_after:,.0f} {response.currency}."
             )
-            self.consumer.start_consuming()
+        return response_message
 
-        except Exception as e:
-            logger.error(f"Error en el consumidor de respuestas de RabbitMQ: {str(e)}", exc_info=True)
-
-    def start(self):
-        """Inicia el consumidor en un thread separado"""
-        if self.consumer_thread is None or not self.consumer_thread.is_alive():
-            self.consumer_thread = threading.Thread(target=self._run_consumer, daemon=True)
-            self.consumer_thread.start()
-            logger.info("Consumidor de respuestas de RabbitMQ iniciado en thread separado")
-
-    def stop(self):
-        """Detiene el consumidor"""
-        if self.consumer:
+    async def _consume(self):
+        """Recibe mensajes de la cola de respuestas y los despacha en lotes"""
+        # La conexión robusta se restablece sola; aquí se reintenta la conexión inicial y
+        # cualquier fallo al preparar el canal, para que el consumidor no quede detenido
+        while True:
+            channel = None
             try:
-                self.consumer.stop_consuming()
-                logger.info("Consumidor de respuestas de RabbitMQ detenido")
+                if self.connection is None:
+                    self.connection = await aio_pika.connect_robust(
+                        host=settings.RABBITMQ_HOST,
+                        port=settings.RABBITMQ_PORT,
+                        login=settings.RABBITMQ_USER,
+                        password=settings.RABBITMQ_PASSWORD,
+                        virtualhost=settings.RABBITMQ_VHOST,
+                    )
+
+                channel = await self.connection.channel()
+                # Prefetch de un lote completo por cada lote que puede estar escribiéndose en BD
+                await channel.set_qos(
+                    prefetch_count=RESPONSE_BATCH_SIZE * RESPONSE_MAX_CONCURRENT_BATCHES
+                )
+                queue = await channel.declare_queue(settings.RABBITMQ_RESPONSE_QUEUE, durable=True)
+
+                incoming: asyncio.Queue[AbstractIncomingMessage] = asyncio.Queue()
+                await queue.consume(incoming.put)
+                logger.info("Esperando mensajes en la cola '%s'", settings.RABBITMQ_RESPONSE_QUEUE)
+
+                await self._dispatch_batches(incoming)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Error al detener consumidor de respuestas: {str(e)}")
+                logger.warning(
+                    "Error en el consumidor de respuestas de RabbitMQ: %s. Reintentando en %ss",
+                    e,
+                    CONNECT_RETRY_DELAY_SECONDS,
+                    exc_info=True,
+                )
+                # Los mensajes sin ACK del canal cerrado se reentregan al siguiente consumidor
+                if channel is not None and not channel.is_closed:
+                    try:
+                        await channel.close()
+                    except Exception:
+                        pass
+                await asyncio.sleep(CONNECT_RETRY_DELAY_SECONDS)
+
+    async def _dispatch_batches(self, incoming: asyncio.Queue[AbstractIncomingMessage]):
+        """Agrupa las entregas en lotes de hasta 100 mensajes o 50 ms y lanza su escritura"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await incoming.get()]
+            deadline = loop.time() + RESPONSE_BATCH_TIMEOUT_SECONDS
+            while len(batch) < RESPONSE_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(incoming.get(), remaining))
+                except TimeoutError:
+                    break
+
+            await self._db_slots.acquire()
+            task = asyncio.create_task(self._handle_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._batch_tasks.discard(task)
+        self._db_slots.release()
+
+    async def _handle_batch(self, batch: list[AbstractIncomingMessage]):
+        """Decodifica un lote, lo escribe en BD y confirma cada mensaje después de guardarlo"""
+        payloads: list[TransferResponse] = []
+        decoded = []
+        for message in batch:
+            try:
+                # JSON y esquema se validan en una sola pasada, con los tipos ya convertidos
+                payloads.append(TransferResponse.model_validate_json(message.body))
+                decoded.append(message)
+            except ValidationError as e:
+                logger.error("Mensaje de respuesta inválido: %s. Body: %s", e, message.body[:200])
+                # Rechazar el mensaje y no reintentarlo (mensaje malformado)
+                await message.reject(requeue=False)
+
+        if not decoded:
+            return
+
+        try:
+            await run_in_threadpool(self._process_batch, payloads)
+        except Exception as e:
+            logger.error(
+                "Error al procesar lote de %s mensaje(s): %s", len(decoded), e, exc_info=True
+            )
+            # Rechazar el lote y reintentarlo (error transitorio)
+            for message in decoded:
+                await message.nack(requeue=True)
+            return
+
+        # ACK individual: con varios lotes en curso un ACK múltiple confirmaría los de otro lote
+        for message in decoded:
+            await message.ack()
+        logger.info("Lote de %s mensaje(s) procesado exitosamente", len(decoded))
+
+    async def start(self):
+        """Inicia el consumidor como tarea del event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._consume())
+            logger.info("Consumidor de respuestas de RabbitMQ iniciado")
 
+    async def stop(self):
+        """Detiene el consumidor: deja terminar los lotes en curso y cierra la conexión"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+
+        try:
+            if self.connection and not self.connection.is_closed:
+                await self.connection.close()
+            logger.info("Consumidor de respuestas de RabbitMQ detenido")
+        except Exception as e:
+            logger.error("Error al detener consumidor de respuestas: %s", e)
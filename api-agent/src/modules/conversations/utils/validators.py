@@ -1,8 +1,84 @@
 import re
+from typing import NamedTuple
+
+# Patrones compilados una sola vez al importar el módulo
+_PHONE_RE = re.compile(r"\b\d{10}\b")
+_NON_DIGIT_RE = re.compile(r"[^\d]")
+_DECIMAL_COMMA_RE = re.compile(r",(\d{1,2})$")
+_NUMBER_RE = re.compile(r"\d+\.?\d*")
+
+# Caracteres que solo hay que borrar: str.translate con tablas precalculadas, sin regex
+_WHITESPACE = " \t\n\r\f\v\xa0"
+_PHONE_SEPARATORS = str.maketrans("", "", _WHITESPACE + "-()")
+_AMOUNT_NOISE = str.maketrans("", "", _WHITESPACE + "$")
+
+
+# Temas que claramente NO son transferencias; solo se bloquean los obviamente fuera de contexto
+_OUT_OF_CONTEXT_WORDS = frozenset(
+    {
+        # Astronomía y espacio
+        "planeta",
+        "planetas",
+        "estrella",
+        "estrellas",
+        "galaxia",
+        "galaxias",
+        "universo",
+        "astronomía",
+        "astronomia",
+        "astronauta",
+        "nasa",
+        "satélite",
+        "satelite",
+    }
+)
+_OUT_OF_CONTEXT_PHRASES = (
+    # Astronomía y espacio
+    "distancia del sol",
+    "distancia de la luna",
+    "distancia entre el sol y la luna",
+    "tamaño del sol",
+    "tamaño de la luna",
+    # Ciencia general (solo si es muy específico)
+    "fórmula química",
+    "formula quimica",
+    "ecuación física",
+    "ecuacion fisica",
+    "teorema matemático",
+    "teorema matematico",
+    # Historia y geografía (solo si es muy específico)
+    "año de independencia",
+    "capital de",
+    "país más grande",
+    "pais mas grande",
+    # Clima (solo si es muy específico)
+    "temperatura en",
+    "clima en",
+    "pronóstico del tiempo",
+    "pronostico del tiempo",
+)
+# Todas las frases en una sola alternación: una pasada del motor de regex por mensaje
+_OUT_OF_CONTEXT_PHRASE_RE = re.compile("|".join(map(re.escape, _OUT_OF_CONTEXT_PHRASES)))
+# Primera palabra de cada frase: sin ninguna de ellas no hace falta buscar las frases
+_OUT_OF_CONTEXT_ANCHORS = frozenset(phrase.split(" ", 1)[0] for phrase in _OUT_OF_CONTEXT_PHRASES)
+_WORD_PUNCTUATION = ".,;:!?¡¿\"'()"
+# Un mensaje más corto que la palabra más corta no puede estar fuera de contexto
+_MIN_OUT_OF_CONTEXT_LEN = min(map(len, _OUT_OF_CONTEXT_WORDS))
+# Un teléfono con separadores razonables nunca supera este largo
+_MAX_PHONE_INPUT_LEN = 30
+
+
+class ScanResult(NamedTuple):
+    phone: str | None
+    amount: float | None
+    is_transfer: bool
 
 
 def validate_phone_number(phone: str) -> tuple[bool, str | None]:
-    cleaned_phone = re.sub(r"[\s\-\(\)]", "", phone)
+    if len(phone) > _MAX_PHONE_INPUT_LEN:
+        return False, "El número de teléfono es demasiado largo"
+
+    cleaned_phone = phone.translate(_PHONE_SEPARATORS)
 
     if not cleaned_phone.isdigit():
         return False, "El número de teléfono debe contener solo dígitos"
@@ -17,12 +93,11 @@ def validate_phone_number(phone: str) -> tuple[bool, str | None]:
 
 
 def extract_phone_number(text: str) -> str | None:
-    pattern = r"\b\d{10}\b"
-    matches = re.findall(pattern, text)
-    if matches:
-        return matches[0]
+    match = _PHONE_RE.search(text)
+    if match:
+        return match.group()
 
-    cleaned = re.sub(r"[^\d]", "", text)
+    cleaned = _NON_DIGIT_RE.sub("", text)
     if len(cleaned) == 10:
         return cleaned
     elif len(cleaned) == 11:
@@ -32,18 +107,18 @@ def extract_phone_number(text: str) -> str | None:
 
 
 def validate_amount(amount_text: str) -> tuple[bool, float | None, str | None]:
-    cleaned = re.sub(r"[\s\$]", "", amount_text.lower())
-    cleaned = re.sub(r",(\d{1,2})$", r".\1", cleaned)
+    cleaned = amount_text.lower().translate(_AMOUNT_NOISE)
+    cleaned = _DECIMAL_COMMA_RE.sub(r".\1", cleaned)
     if cleaned.count(".") > 1:
         parts = cleaned.split(".")
         cleaned = "".join(parts[:-1]) + "." + parts[-1]
     
-    numbers = re.findall(r"\d+\.?\d*", cleaned)
-    if not numbers:
+    number = _NUMBER_RE.search(cleaned)
+    if not number:
         return False, None, "No se pudo encontrar un monto válido en tu mensaje"
 
     try:
-        amount = float(numbers[0])
+        amount = float(number.group())
         if amount <= 0:
             return False, None, "El monto debe ser mayor a 0"
         return True, amount, None
@@ -58,107 +133,55 @@ def extract_amount(text: str) -> float | None:
     return None
 
 
-def is_transfer_related(message: str, conversation_context: list[dict] | None = None) -> bool:
+def scan_message(text: str, check_topic: bool = True) -> ScanResult:
+    """
+    Analiza el mensaje en una sola pasada: teléfono, monto y si trata de transferencias.
+
+    El monto se busca en el texto sin el teléfono para no confundir sus dígitos con el monto.
+    Con check_topic=False no se clasifica el tema del mensaje (el agente solo lo usa como
+    respaldo cuando la extracción del LLM no devuelve un JSON válido).
+    """
+    phone = extract_phone_number(text)
+    if phone is None:
+        amount = extract_amount(text)
+    elif phone in text:
+        amount = extract_amount(text.replace(phone, " ", 1))
+    else:
+        # El teléfono se armó con todos los dígitos del mensaje: no queda monto
+        amount = None
+
+    is_transfer = not check_topic or is_transfer_related(text)
+    return ScanResult(phone, amount, is_transfer)
+
+
+def is_transfer_related(message: str) -> bool:
     """
     Verifica si el mensaje está relacionado con transferencias de dinero.
     Enfoque permisivo: solo bloquea temas claramente fuera de contexto.
-    Si hay contexto de conversación, es muy permisivo para permitir conversaciones naturales.
-    
+
     Args:
         message: El mensaje a validar
-        conversation_context: Lista de mensajes previos en la conversación (opcional)
-    
+
     Retorna True si el mensaje está relacionado o si no se puede determinar claramente,
     False solo para temas claramente fuera de contexto.
     """
     message_lower = message.lower().strip()
-    
-    # Si el mensaje está vacío, permitirlo
-    if not message_lower:
-        return True
-    
-    # Verificar si hay contexto previo de conversación
-    has_conversation_context = False
-    if conversation_context and len(conversation_context) > 1:
-        # Si hay más de un mensaje, hay contexto de conversación
-        has_conversation_context = True
-    
-    # Lista muy específica de temas que claramente NO son transferencias
-    # Solo bloquear temas obviamente fuera de contexto
-    clearly_out_of_context = [
-        # Astronomía y espacio
-        "distancia del sol",
-        "distancia de la luna",
-        "distancia del sol a la luna",
-        "distancia entre el sol y la luna",
-        "tamaño del sol",
-        "tamaño de la luna",
-        "planeta",
-        "planetas",
-        "estrella",
-        "estrellas",
-        "galaxia",
-        "galaxias",
-        "universo",
-        "astronomía",
-        "astronomia",
-        "astronauta",
-        "nasa",
-        "satélite",
-        "satelite",
-        # Ciencia general (solo si es muy específico)
-        "fórmula química",
-        "formula quimica",
-        "ecuación física",
-        "ecuacion fisica",
-        "teorema matemático",
-        "teorema matematico",
-        # Historia y geografía (solo si es muy específico)
-        "año de independencia",
-        "año de independencia de",
-        "capital de",
-        "país más grande",
-        "pais mas grande",
-        # Clima (solo si es muy específico)
-        "temperatura en",
-        "clima en",
-        "pronóstico del tiempo",
-        "pronostico del tiempo",
-    ]
-    
-    # Verificar si el mensaje contiene temas claramente fuera de contexto
-    # Solo bloquear si es muy específico y obviamente no relacionado
-    for keyword in clearly_out_of_context:
-        if keyword in message_lower:
-            return False
-    
-    # Si hay contexto de conversación, ser MUY permisivo
-    # Permitir casi todo excepto temas claramente fuera de contexto
-    if has_conversation_context:
-        return True
-    
-    # Si no hay contexto, ser un poco más estricto pero aún permisivo
-    # Permitir saludos y preguntas generales
-    greetings = [
-        "hola", "hi", "hello", "buenos días", "buenos dias", "buenas tardes",
-        "buenas noches", "good morning", "good afternoon", "good evening",
-        "hey", "saludos", "greetings", "qué tal", "que tal", "what's up"
-    ]
-    
-    if any(greeting in message_lower for greeting in greetings):
-        return True
-    
-    # Permitir preguntas sobre ayuda, proceso, instrucciones
-    help_keywords = [
-        "ayuda", "help", "cómo", "como", "how", "qué", "que", "what",
-        "dime", "cuéntame", "cuentame", "tell me", "explicar", "explain",
-        "paso", "pasos", "proceso", "instrucciones", "siguiente", "next",
-        "luego", "después", "despues", "after", "hacer", "do"
-    ]
-    
-    if any(keyword in message_lower for keyword in help_keywords):
+
+    # Si el mensaje está vacío o es muy corto para contener un tema bloqueado, permitirlo
+    if len(message_lower) < _MIN_OUT_OF_CONTEXT_LEN:
         return True
-    
-    # Por defecto, permitir (ser permisivo y confiar en el system prompt)
-    # Solo bloquear si es claramente fuera de contexto
+
+    # Palabras sueltas: una sola tokenización y una intersección con el conjunto
+    words = {word.strip(_WORD_PUNCTUATION) for word in message_lower.split()}
+    if not _OUT_OF_CONTEXT_WORDS.isdisjoint(words):
+        return False
+
+    # Frases de varias palabras: solo se buscan si el mensaje tiene alguno de sus anclajes
+    if not _OUT_OF_CONTEXT_ANCHORS.isdisjoint(words) and _OUT_OF_CONTEXT_PHRASE_RE.search(
+        message_lower
+    ):
+        return False
+
+    # Todo lo demás (saludos, preguntas de ayuda, datos de la transferencia) se permite:
+    # el system prompt se encarga del resto
     return True
@@ -0,0 +1,51 @@
+import pytest
+
+from src.modules.conversations.utils.validators import is_transfer_related, scan_message
+
+
+@pytest.mark.parametrize(
+    ("message", "expected"),
+    [
+        # Bloqueados: palabra completa o frase fuera de contexto
+        ("Háblame de los planetas", False),
+        ("¿Qué hace la NASA?", False),
+        ("estrellas.", False),
+        ("¿Cuál es la distancia del sol?", False),
+        ("¿Cuál es la capital de Francia?", False),
+        ("pronóstico del tiempo para mañana", False),
+        # Permitidos: antes se bloqueaban por coincidencia de subcadena
+        ("Te espero en el planetario", True),
+        ("tengo congestión nasal", True),
+        ("el carro quedó estrellado", True),
+        # Permitidos: mensajes de transferencias
+        ("hola", True),
+        ("quiero enviar 50000 al 3001234567", True),
+        ("", True),
+    ],
+)
+def test_is_transfer_related(message, expected):
+    assert is_transfer_related(message) is expected
+
+
+@pytest.mark.parametrize(
+    ("message", "phone", "amount"),
+    [
+        ("enviar 100 al 3001234567", "3001234567", 100.0),
+        ("3001234567 1.500,50", "3001234567", 1500.5),
+        ("(300) 123 4567", "3001234567", None),
+        ("300-123-4567", "3001234567", None),
+        ("mándale 2500,75", None, 2500.75),
+        ("transfiere $ 20000", None, 20000.0),
+        ("hola", None, None),
+    ],
+)
+def test_scan_message_extracts_phone_and_amount(message, phone, amount):
+    result = scan_message(message, check_topic=False)
+    assert result.phone == phone
+    assert result.amount == amount
+    assert result.is_transfer is True
+
+
+def test_scan_message_checks_topic():
+    assert scan_message("Háblame de los planetas").is_transfer is False
+    assert scan_message("Háblame de los planetas", check_topic=False).is_transfer is True